@@ -0,0 +1,67 @@
+import threading
+
+import boto3
+from botocore.config import Config
+
+# Each Lambda image is built from its own directory, keep the copies of this file in meta/, processor/ and event/ identical (checked by tests/test_shared_modules.py)
+
+# Shared by every client: keep connections alive between warm invocations, and allow
+# as many pooled connections as the handlers run transfer threads
+CLIENT_CONFIG = Config(max_pool_connections=32, tcp_keepalive=True, retries={'mode': 'standard'})
+
+_lock = threading.Lock()
+_clients = {}
+_tables = {}
+
+def get_client(service_name):
+    """
+    boto3 client for a service, created on first use and reused for the life of the container
+    :param service_name:  e.g. 's3', 'rekognition'
+    :return:              Client
+    """
+    client = _clients.get(service_name)
+    if client is None:
+        # creating clients from the default session is not thread safe
+        with _lock:
+            client = _clients.get(service_name)
+            if client is None:
+                client = boto3.client(service_name, config=CLIENT_CONFIG)
+                _clients[service_name] = client
+    return client
+
+def get_table(table_name):
+    """
+    DynamoDB Table, created on first use and reused for the life of the container
+    :param table_name:  DynamoDB table name
+    :return:            Table resource
+    """
+    table = _tables.get(table_name)
+    if table is None:
+        with _lock:
+            table = _tables.get(table_name)
+            if table is None:
+                table = boto3.resource('dynamodb', config=CLIENT_CONFIG).Table(table_name)
+                _tables[table_name] = table
+    return table
+
+class Lazy:
+    """
+    Module level stand-in for a client or table that is only created when first used.
+
+    Attribute access is forwarded to the object returned by factory(name), so
+    handlers keep calling e.g. s3.upload_file() while a cold start no longer
+    pays for clients the invocation never touches.
+    """
+
+    def __init__(self, factory, name):
+        self._factory = factory
+        self._name = name
+
+    def __getattr__(self, attribute):
+        return getattr(self._factory(self._name), attribute)
+
+def lazy_client(service_name):
+    return Lazy(get_client, service_name)
+
+def lazy_table(table_name):
+    return Lazy(get_table, table_name)
@@ -1,20 +1,54 @@
 import logging
 import subprocess
-import uuid
-import boto3
+import csv
 import os
-import json
-import sys
-import time
 
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 
+from clients import lazy_client, lazy_table
+from scratch import ScratchSpace
+from segments import unpack_segments
+
 SIGNED_URL_EXPIRATION = 60 * 60 * 24 * 7
+# slicing is mostly network bound and GIF rendering CPU bound, one worker per vCPU keeps both busy
+SEGMENT_WORKERS = int(os.environ.get('SEGMENT_WORKERS', os.cpu_count() or 1))
+# 'auto' downloads the I-Frames video once when it fits in scratch space and reads it through a signed URL
+# otherwise, 'local' always downloads it, 'remote' never does
+SOURCE_MODE = os.environ.get('SOURCE_MODE', 'auto')
+# scratch space kept free per worker for the clip and GIF it is writing
+SLICE_HEADROOM_BYTES = 32 * 1024 * 1024
+TRANSFER_CONCURRENCY = int(os.environ.get('TRANSFER_CONCURRENCY', 8))
+TRANSFER_PART_SIZE = int(os.environ.get('TRANSFER_PART_MB', 16)) * 1024 * 1024
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=TRANSFER_PART_SIZE, multipart_chunksize=TRANSFER_PART_SIZE,
+                                 max_concurrency=TRANSFER_CONCURRENCY, use_threads=True)
+# 'one-pass' cuts every clip out of the video with one ffmpeg run and renders the GIFs of consecutive shots
+# together, 'per-shot' runs two ffmpeg per shot; shots the one-pass run cannot cut cleanly fall back to per-shot
+CLIP_MODE = os.environ.get('CLIP_MODE', 'one-pass')
+# shots rendered by one ffmpeg in one-pass mode, each adds a branch to its filter graph
+GIF_BATCH_SIZE = int(os.environ.get('GIF_BATCH_SIZE', 16))
+# cut points closer than this are merged, and a clip whose bounds are further off from its shot is redone per shot
+CUT_TOLERANCE_MILLIS = 100
+GIF_FPS = int(os.environ.get('GIF_FPS', 10))
+GIF_WIDTH = int(os.environ.get('GIF_WIDTH', 240))
+# longest GIF rendered from a shot, 0 renders whole shots
+GIF_MAX_DURATION_MILLIS = int(os.environ.get('GIF_MAX_DURATION_MS', 0))
+GIF_FILTER = 'fps={},scale={}:-1:flags=lanczos'.format(GIF_FPS, GIF_WIDTH)
+# 'global' builds one palette from the whole proxy that all GIFs share, 'per-batch' one per render_gifs batch of
+# consecutive shots (also used when there is no proxy), 'per-shot' one for every GIF when quality demands it
+GIF_PALETTE = os.environ.get('GIF_PALETTE', 'global')
+# 'auto' downscales the video once into a low resolution proxy the GIFs are rendered from, when it fits in
+# scratch space; 'off' renders every GIF from the full resolution video
+GIF_PROXY = os.environ.get('GIF_PROXY', 'auto')
+# generous estimate of the proxy's size per second of video, it is near lossless at GIF size
+GIF_PROXY_BYTES_PER_SECOND = 256 * 1024
+# suffix meta.py appends to the key of the I-Frames copy
+IFRAME_SUFFIX = '-iframe-output'
 
-s3 = boto3.client('s3')
+s3 = lazy_client('s3')
 
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(os.environ.get('DYNAMODB_TABLE'))
+table = lazy_table(os.environ.get('DYNAMODB_TABLE'))
 
 LAMBDA_TASK_ROOT = os.environ.get('LAMBDA_TASK_ROOT')
 # ffmpeg_path = os.path.join(LAMBDA_TASK_ROOT, 'ffmpeg')
@@ -47,8 +81,8 @@ def lambda_handler(event, context):
     #   's3Bucket': 'kadastack-processed-video',
     #   'segmentsMeta': [
     #     {
-    #       'startTimecodeSMPTE': '00:01:00',
-    #       'durationSMPTE': '00:00:10',
+    #       'startTimecodeSMPTE': '00:01:00:00',
+    #       'durationSMPTE': '00:00:10:00',
     #       'startTimestampMillis': 60000,
     #       'endTimestampMillis': 70000,
     #       'durationMillis': 10000
@@ -71,8 +105,8 @@ def lambda_handler(event, context):
         The event detail is updated with schema below:
         segments_meta = []
         segment_info = {
-            'startTimecodeSMPTE': segment['StartTimecodeSMPTE'].rsplit(':', 1)[0],
-            'durationSMPTE': segment['DurationSMPTE'].rsplit(':', 1)[0],
+            'startTimecodeSMPTE': segment['StartTimecodeSMPTE'],
+            'durationSMPTE': segment['DurationSMPTE'],
             'startTimestampMillis': segment['StartTimestampMillis'],
             'endTimestampMillis': segment['EndTimestampMillis'],
             'durationMillis': segment['DurationMillis']
@@ -83,76 +117,424 @@ def lambda_handler(event, context):
             # iframe video path
             's3Object': s3Object,
             's3Bucket': s3Bucket,
-            'segmentsMeta': segments_meta
+            'segmentsMeta': segments_meta,
+            # position of this event's segments in the whole video, see processor.chunk_segments
+            'chunk': {'index': 0, 'count': 1, 'offset': 0, 'total': len(segments_meta)}
         }
+        Large segment lists are stored in S3 (see segments.py) and segmentsMeta is replaced by
+        'segmentsRef': {'bucket': s3Bucket, 'key': ..., 'size': bytes, 'count': segments}
+        Slicing only uses the millisecond timestamps, the SMPTE timecodes are informational
         """
-        segments_meta = event_detail['segmentsMeta']
-        signed_url = get_signed_url(SIGNED_URL_EXPIRATION, s3Bucket, s3Object)
-        # double quote the singed url
-        signed_url = '"' + signed_url + '"'
-        logger.info("iframe video bucket: {}, key: {}, signed URL: {}".format(s3Bucket, s3Object, signed_url))
-
-        for segment in segments_meta:
-            RANDOM_VIDEO_FILE = str(uuid.uuid4()) + '-sliced-output.mp4'
-            RANDOM_GIF_FILE = str(uuid.uuid4()) + '-sliced-output.gif'
-
-            startTimecodeSMPTE = segment['startTimecodeSMPTE']
-            durationSMPTE = segment['durationSMPTE']
-
-            LOCAL_SLICED_VIDEO_FILE = '/tmp/' + RANDOM_VIDEO_FILE
-            LOCAL_SLICED_GIF_FILE = '/tmp/' + RANDOM_GIF_FILE
-            REMOTE_SLICED_VIDEO_FILE = s3Object.split('.')[0] + '/' + RANDOM_VIDEO_FILE
-            REMOTE_SLICED_GIF_FILE = s3Object.split('.')[0] + '/' + RANDOM_GIF_FILE
-
-            # slice video
-            CMD = ['ffmpeg', '-ss', startTimecodeSMPTE, '-t', durationSMPTE, '-i', signed_url, '-vcodec copy -acodec copy ', LOCAL_SLICED_VIDEO_FILE]
-            SHELL_CMD = ' '.join(CMD)
-            try:
-                subprocess.check_output(SHELL_CMD, shell=True)
-                upload_file(LOCAL_SLICED_VIDEO_FILE, s3Bucket, REMOTE_SLICED_VIDEO_FILE)
-                logger.info("Uploaded sliced I-Frames {} to S3".format(REMOTE_SLICED_VIDEO_FILE))
-                os.remove(LOCAL_SLICED_VIDEO_FILE)
-            except subprocess.CalledProcessError as e:
-                logger.error("Error: {}, return code {}".format(e.output.decode('utf-8'), e.returncode))
-
-            # generate gif from sliced video
-            CMD = ['ffmpeg', '-loglevel error -ss', startTimecodeSMPTE, '-t', durationSMPTE, '-y -i', signed_url, '-vf "fps=10,scale=240:-1:flags=lanczos,split[s0][s1];[s0]palettegen[p];[s1][p]paletteuse" -loop 0', LOCAL_SLICED_GIF_FILE]
-            SHELL_CMD = ' '.join(CMD)
-            try:
-                subprocess.check_output(SHELL_CMD, shell=True)
-                upload_file(LOCAL_SLICED_GIF_FILE, s3Bucket, REMOTE_SLICED_GIF_FILE)
-                logger.info("Uploaded sliced GIF image {} to S3".format(REMOTE_SLICED_GIF_FILE))
-                os.remove(LOCAL_SLICED_GIF_FILE)
-            except subprocess.CalledProcessError as e:
-                logger.error("Error: {}, return code {}".format(e.output.decode('utf-8'), e.returncode))
-
-        # Update sliced video and GIF info to DynamoDB
-        logger.info('DynamoDB key is {}'.format(s3Object.split('.')[0].rsplit('-')[0] + '.' + s3Object.split('.')[1]))
-        
-        sliced_video_list = [s3Object.split('.')[0] + '/' + segment['startTimecodeSMPTE'] + '-' + segment['durationSMPTE'] + '-sliced-output.mp4' for segment in segments_meta]
-        sliced_gif_list = [s3Object.split('.')[0] + '/' + segment['startTimecodeSMPTE'] + '-' + segment['durationSMPTE'] + '-sliced-output.gif' for segment in segments_meta]
+        if 'segmentsRef' in event_detail:
+            # claim check, the segments were too many for the event and are stored in S3
+            segments_meta = read_segments(event_detail['segmentsRef'])
+        else:
+            segments_meta = event_detail['segmentsMeta']
+        # Slice and render the segments on a worker pool; each worker uploads its files while the others
+        # keep encoding. Results come back in segment order with None for whatever failed
+        results = []
+        if not segments_meta:
+            # nothing to download or cut, the chunk is still applied below
+            logger.info("No segments in this event")
+        else:
+            # Every file of this invocation lives in its scratch directory, which is removed however the invocation ends
+            with ScratchSpace() as scratch:
+                source, size = fetch_source(s3Bucket, s3Object, scratch)
+                with ThreadPoolExecutor(max_workers=SEGMENT_WORKERS) as executor:
+                    # the GIF proxy is decoded while the clips are cut
+                    gif_source = executor.submit(make_gif_source, segments_meta, source, scratch)
+                    results = [None] * len(segments_meta)
+                    if CLIP_MODE == 'one-pass':
+                        results = slice_all_segments(segments_meta, source, size, gif_source, s3Object, s3Bucket, scratch, executor)
+                    pending = [index for index, result in enumerate(results) if result is None]
+                    if pending:
+                        logger.info("Slicing {} of {} segments one ffmpeg run per shot".format(len(pending), len(segments_meta)))
+                        sliced = executor.map(lambda index: slice_segment(segments_meta[index], source, gif_source.result(), s3Object, s3Bucket, scratch), pending)
+                        for index, result in zip(pending, sliced):
+                            results[index] = result
+
+        # Update sliced video and GIF info to DynamoDB, with the keys that were actually uploaded
+        sliced_video_list = [video for video, _ in results if video]
+        sliced_gif_list = [gif for _, gif in results if gif]
+        failed = sum(1 for video, gif in results if not video or not gif)
+        logger.info("Sliced {} videos and {} GIFs from {} segments, {} segments failed".format(
+            len(sliced_video_list), len(sliced_gif_list), len(segments_meta), failed))
+
+        # processor.py sends one event per video, or several chunks with a manifest when the segments exceed
+        # the event size limit; every chunk is applied exactly once even if EventBridge delivers it again
+        chunk = event_detail.get('chunk', {'index': 0, 'count': 1})
+        record_id = original_key(s3Object)
+        logger.info('DynamoDB key is {}'.format(record_id))
+        try:
+            save_sliced_lists(record_id, event_detail['jobId'], chunk, s3Bucket, sliced_video_list, sliced_gif_list)
+        except ClientError as e:
+            logger.error("Error: {}".format(e))
+            logger.error("Failed to update sliced video and GIF info to DynamoDB")
+
+def fetch_source(s3Bucket, s3Object, scratch):
+    """
+    Decide where ffmpeg reads the I-Frames video from
+    :param s3Bucket:  Processed bucket
+    :param s3Object:  I-Frames video key
+    :param scratch:   ScratchSpace of the invocation
+    :return:          (local path if the video was downloaded else its signed URL, size in bytes)
+    """
+    size = s3.head_object(Bucket=s3Bucket, Key=s3Object)['ContentLength']
+    local_file = scratch.path(s3Object)
+    # the copy has to leave room for the clips the workers are writing at the same time
+    if SOURCE_MODE == 'local' or (SOURCE_MODE == 'auto' and scratch.reserve(local_file, size + SEGMENT_WORKERS * SLICE_HEADROOM_BYTES)):
+        # one download instead of two ranged reads over HTTP per segment
+        s3.download_file(s3Bucket, s3Object, local_file, Config=TRANSFER_CONFIG)
+        logger.info("Downloaded iframe video {} ({} bytes) from S3 {}".format(s3Object, size, s3Bucket))
+        return local_file, size
+
+    signed_url = get_signed_url(SIGNED_URL_EXPIRATION, s3Bucket, s3Object)
+    logger.info("iframe video bucket: {}, key: {}, {} bytes, reading through signed URL: {}".format(s3Bucket, s3Object, size, signed_url))
+    return signed_url, size
+
+def make_gif_source(segments_meta, source, scratch):
+    """
+    Downscale the span of the segments once into the low resolution proxy the GIFs are rendered from,
+    together with the global palette when GIF_PALETTE is 'global'
+    :param segments_meta:  Segment dicts from segmentsMeta
+    :param source:         Local copy or signed URL of the I-Frames video
+    :param scratch:        ScratchSpace of the invocation
+    :return:               dict with the 'input' to render from, the 'offset' of its first frame in the video in
+                           millis, the 'filter' still to apply to it and the 'palette' image or None
+    """
+    gif_source = {'input': source, 'offset': 0, 'filter': GIF_FILTER, 'palette': None}
+    if GIF_PROXY == 'off':
+        return gif_source
+    start = min(segment['startTimestampMillis'] for segment in segments_meta)
+    end = max(segment['endTimestampMillis'] for segment in segments_meta)
+    proxy_dir = scratch.mkdtemp()
+    if not scratch.reserve(proxy_dir, (end - start) * GIF_PROXY_BYTES_PER_SECOND // 1000):
+        return gif_source
+
+    proxy = os.path.join(proxy_dir, 'proxy.mp4')
+    palette = os.path.join(proxy_dir, 'palette.png')
+    # frames are already at GIF rate and size, with a keyframe every second so seeking into the proxy stays cheap
+    CMD = ['ffmpeg', '-loglevel', 'error', '-y', '-ss', millis_to_seconds(start), '-t', millis_to_seconds(end - start), '-i', source]
+    if GIF_PALETTE == 'global':
+        CMD += ['-filter_complex', '[0:v]{},split[proxy][s];[s]palettegen[palette]'.format(GIF_FILTER),
+                '-map', '[palette]', '-update', '1', palette, '-map', '[proxy]']
+    else:
+        CMD += ['-map', '0:v:0', '-vf', GIF_FILTER]
+    CMD += ['-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '12', '-pix_fmt', 'yuv444p', '-g', str(GIF_FPS), proxy]
+    try:
+        subprocess.run(CMD, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        logger.error("Error: {}, return code {}".format(e.stderr.decode('utf-8'), e.returncode))
+        scratch.release(proxy_dir)
+        return gif_source
+    logger.info("Downscaled {} ms of video into a {} byte GIF proxy".format(end - start, os.path.getsize(proxy)))
+    return {'input': proxy, 'offset': start, 'filter': None, 'palette': palette if GIF_PALETTE == 'global' else None}
+
+def slice_all_segments(segments_meta, source, size, gif_source, s3Object, s3Bucket, scratch, executor):
+    """
+    Cut all shots out of the I-Frames video in one ffmpeg run and render their GIFs in batches
+    :param segments_meta:  Segment dicts from segmentsMeta
+    :param source:         Local copy or signed URL of the I-Frames video
+    :param size:           Size of the I-Frames video in bytes
+    :param gif_source:     Future of make_gif_source
+    :param s3Object:       I-Frames video key, the files go to a folder of the same name
+    :param s3Bucket:       Processed bucket
+    :param scratch:        ScratchSpace of the invocation
+    :param executor:       Worker pool for the uploads and GIF batches
+    :return:               (video key, GIF key) per segment as slice_segment, None for segments left to slice_segment
+    """
+    results = [None] * len(segments_meta)
+    # stream copy keeps the bytes of the video, so the clips and the gaps between them add up to at most its size
+    clip_dir = scratch.mkdtemp()
+    if not scratch.reserve(clip_dir, size):
+        return results
+
+    # the segment muxer writes one file per interval between cut points, the I-Frames video can be cut at any frame;
+    # only the span of these segments is read, a chunked event covers part of the video
+    start = min(segment['startTimestampMillis'] for segment in segments_meta)
+    end = max(segment['endTimestampMillis'] for segment in segments_meta)
+    cuts = []
+    for millis in sorted({segment['startTimestampMillis'] for segment in segments_meta} | {segment['endTimestampMillis'] for segment in segments_meta}):
+        if start < millis < end and (not cuts or millis - cuts[-1] >= CUT_TOLERANCE_MILLIS):
+            cuts.append(millis)
+    clip_list = os.path.join(clip_dir, 'clips.csv')
+    CMD = ['ffmpeg', '-loglevel', 'error', '-y', '-ss', millis_to_seconds(start), '-t', millis_to_seconds(end - start), '-i', source,
+           '-map', '0:v:0', '-map', '0:a?', '-c', 'copy',
+           '-f', 'segment', '-segment_times', ','.join(millis_to_seconds(millis - start) for millis in cuts),
+           '-segment_list', clip_list, '-segment_list_type', 'csv', '-reset_timestamps', '1',
+           os.path.join(clip_dir, 'clip-%05d.mp4')]
+    try:
+        subprocess.run(CMD, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        logger.error("Error: {}, return code {}".format(e.stderr.decode('utf-8'), e.returncode))
+        scratch.release(clip_dir)
+        return results
+
+    # pieces as (file, start millis, end millis) in cut order, then each shot takes the piece that starts and ends with it
+    with open(clip_list, newline='') as f:
+        pieces = [(os.path.join(clip_dir, name), start + round(float(piece_start) * 1000), start + round(float(piece_end) * 1000))
+                  for name, piece_start, piece_end in csv.reader(f)]
+    clips = {}
+    taken = set()
+    for index, segment in enumerate(segments_meta):
+        for piece in pieces:
+            if abs(piece[1] - segment['startTimestampMillis']) < CUT_TOLERANCE_MILLIS:
+                if abs(piece[2] - segment['endTimestampMillis']) < CUT_TOLERANCE_MILLIS and piece[0] not in taken:
+                    clips[index] = piece[0]
+                    taken.add(piece[0])
+                break
+    # pieces between shots are not uploaded
+    for piece in pieces:
+        if piece[0] not in taken:
+            os.remove(piece[0])
+    logger.info("Cut {} of {} segments in one pass into {} pieces".format(len(clips), len(segments_meta), len(pieces)))
+
+    prefix = s3Object.split('.')[0] + '/'
+    videos = {index: executor.submit(upload_clip, path, s3Bucket, prefix + sliced_name(segments_meta[index]) + '.mp4')
+              for index, path in clips.items()}
+    cut = sorted(clips, key=lambda index: segments_meta[index]['startTimestampMillis'])
+    batches = [executor.submit(render_gifs, [segments_meta[index] for index in cut[i:i + GIF_BATCH_SIZE]], gif_source.result(), prefix, s3Bucket, scratch)
+               for i in range(0, len(cut), GIF_BATCH_SIZE)]
+    gifs = {}
+    for batch in batches:
+        gifs.update(batch.result())
+    for index in clips:
+        results[index] = (videos[index].result(), gifs.get(sliced_name(segments_meta[index])))
+    scratch.release(clip_dir)
+    return results
+
+def upload_clip(local_file, s3Bucket, remote_file):
+    """
+    Upload a clip cut by slice_all_segments
+    :return:  remote_file if uploaded, else None
+    """
+    uploaded = upload_file(local_file, s3Bucket, remote_file)
+    os.remove(local_file)
+    if not uploaded:
+        return None
+    logger.info("Uploaded {} to S3".format(remote_file))
+    return remote_file
+
+def render_gifs(segments, gif_source, prefix, s3Bucket, scratch):
+    """
+    Render the GIFs of consecutive shots with one ffmpeg that decodes only the part of the video they span
+    :param segments:    Segment dicts ordered by start
+    :param gif_source:  Input to render from, see make_gif_source
+    :param prefix:      S3 folder of the sliced files
+    :param s3Bucket:    Processed bucket
+    :param scratch:     ScratchSpace of the invocation
+    :return:            {sliced name: GIF key} of the GIFs that were uploaded
+    """
+    start = segments[0]['startTimestampMillis']
+    end = max(gif_end(segment) for segment in segments)
+    count = len(segments)
+    per_batch = not gif_source['palette'] and GIF_PALETTE != 'per-shot'
+    # one decode split into a branch per shot, each trimmed to its shot, plus one for the batch palette
+    graph = ['[0:v]{}split={}{}{}'.format(gif_source['filter'] + ',' if gif_source['filter'] else '', count + per_batch,
+                                          ''.join('[v{}]'.format(i) for i in range(count)), '[batch]' if per_batch else '')]
+    if gif_source['palette']:
+        graph.append('[1:v]split={}{}'.format(count, ''.join('[p{}]'.format(i) for i in range(count))))
+    elif per_batch:
+        # palettegen emits at the end of the batch, so the shots are held in memory until then; GIF_BATCH_SIZE bounds it
+        graph.append('[batch]palettegen,split={}{}'.format(count, ''.join('[p{}]'.format(i) for i in range(count))))
+    outputs = []
+    for i, segment in enumerate(segments):
+        trim = '[v{0}]trim=start={1}:end={2},setpts=PTS-STARTPTS'.format(
+            i, millis_to_seconds(segment['startTimestampMillis'] - start), millis_to_seconds(gif_end(segment) - start))
+        if gif_source['palette'] or per_batch:
+            graph.append('{0}[t{1}];[t{1}][p{1}]paletteuse[g{1}]'.format(trim, i))
+        else:
+            # a palette of its own for every shot
+            graph.append('{0},split[s{1}][t{1}];[s{1}]palettegen[p{1}];[t{1}][p{1}]paletteuse[g{1}]'.format(trim, i))
+        outputs += ['-map', '[g{}]'.format(i), '-loop', '0', scratch.path(sliced_name(segment) + '.gif')]
+    CMD = ['ffmpeg', '-loglevel', 'error', '-y', '-ss', millis_to_seconds(start - gif_source['offset']), '-t', millis_to_seconds(end - start),
+           '-i', gif_source['input']]
+    if gif_source['palette']:
+        CMD += ['-i', gif_source['palette']]
+    CMD += ['-filter_complex', ';'.join(graph)] + outputs
+    try:
+        subprocess.run(CMD, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        logger.error("Error: {}, return code {}".format(e.stderr.decode('utf-8'), e.returncode))
+        for segment in segments:
+            scratch.release(scratch.path(sliced_name(segment) + '.gif'))
+        return {}
+
+    gifs = {}
+    for segment in segments:
+        name = sliced_name(segment)
+        local_file = scratch.path(name + '.gif')
+        uploaded = upload_file(local_file, s3Bucket, prefix + name + '.gif')
+        scratch.release(local_file)
+        if uploaded:
+            logger.info("Uploaded {} to S3".format(prefix + name + '.gif'))
+            gifs[name] = prefix + name + '.gif'
+    return gifs
+
+def slice_segment(segment, source, gif_source, s3Object, s3Bucket, scratch):
+    """
+    Cut one shot out of the I-Frames video as mp4 and GIF and upload both
+    :param segment:     Segment dict from segmentsMeta
+    :param source:      Local copy or signed URL of the I-Frames video
+    :param gif_source:  Input to render the GIF from, see make_gif_source
+    :param s3Object:    I-Frames video key, the files go to a folder of the same name
+    :param s3Bucket:    Processed bucket
+    :param scratch:     ScratchSpace of the invocation
+    :return:            (video key, GIF key), None for a file that could not be made or uploaded
+    """
+    name = sliced_name(segment)
+    # seeking on the input jumps straight to the start, and every frame of the I-Frames video is a keyframe,
+    # so stream copy still cuts at the exact frame
+    start = millis_to_seconds(segment['startTimestampMillis'])
+    duration = millis_to_seconds(segment['durationMillis'])
+
+    # slice video
+    LOCAL_SLICED_VIDEO_FILE = scratch.path(name + '.mp4')
+    REMOTE_SLICED_VIDEO_FILE = s3Object.split('.')[0] + '/' + name + '.mp4'
+    CMD = ['ffmpeg', '-loglevel', 'error', '-y', '-ss', start, '-t', duration, '-i', source,
+           '-vcodec', 'copy', '-acodec', 'copy', LOCAL_SLICED_VIDEO_FILE]
+    video = run_and_upload(CMD, LOCAL_SLICED_VIDEO_FILE, s3Bucket, REMOTE_SLICED_VIDEO_FILE, scratch)
+
+    # generate gif of the shot
+    gif = render_gifs([segment], gif_source, s3Object.split('.')[0] + '/', s3Bucket, scratch).get(name)
+    return video, gif
+
+def sliced_name(segment):
+    """
+    File name of a segment's clip and GIF, without extension
+    """
+    # named after the segment, so a redelivered event overwrites rather than duplicates its files
+    return '{}-{}-sliced-output'.format(segment['startTimestampMillis'], segment['durationMillis'])
+
+def gif_end(segment):
+    """
+    End of a segment's GIF in millis, shots longer than GIF_MAX_DURATION_MS are cut short
+    """
+    if GIF_MAX_DURATION_MILLIS:
+        return min(segment['endTimestampMillis'], segment['startTimestampMillis'] + GIF_MAX_DURATION_MILLIS)
+    return segment['endTimestampMillis']
+
+def millis_to_seconds(millis):
+    """
+    Format milliseconds as seconds for ffmpeg time options
+    """
+    return '{:.3f}'.format(millis / 1000)
+
+def run_and_upload(CMD, local_file, s3Bucket, remote_file, scratch):
+    """
+    Run ffmpeg and upload the file it writes
+    :return:  remote_file if uploaded, else None
+    """
+    try:
+        subprocess.run(CMD, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        logger.error("Error: {}, return code {}".format(e.stderr.decode('utf-8'), e.returncode))
+        return None
+    uploaded = upload_file(local_file, s3Bucket, remote_file)
+    scratch.release(local_file)
+    if not uploaded:
+        return None
+    logger.info("Uploaded {} to S3".format(remote_file))
+    return remote_file
+
+def original_key(s3Object):
+    """
+    Key of the uploaded video an I-Frames video was made from
+    """
+    # Strip -iframe-output to restore original video name, 'SampleVideo_1280x720_30mb-iframe-output.mp4' to 'SampleVideo_1280x720_30mb.mp4'
+    base, _, extension = s3Object.partition('.')
+    if base.endswith(IFRAME_SUFFIX):
+        base = base[:-len(IFRAME_SUFFIX)]
+    return base + '.' + extension
+
+def read_segments(segments_ref):
+    """
+    Read the segments of a claim-check event
+    :param segments_ref:  Pointer from the event detail: bucket, key, size and segment count
+    :return:              List of segment dicts as in segmentsMeta
+    """
+    # the size is known from the event, so the whole file is one ranged GET
+    response = s3.get_object(Bucket=segments_ref['bucket'], Key=segments_ref['key'],
+                             Range='bytes=0-{}'.format(segments_ref['size'] - 1))
+    segments_meta = unpack_segments(response['Body'].read())
+    logger.info("Read {} segments from s3://{}/{}".format(len(segments_meta), segments_ref['bucket'], segments_ref['key']))
+    return segments_meta
+
+def save_sliced_lists(record_id, job_id, chunk, s3Bucket, sliced_video_list, sliced_gif_list):
+    """
+    Add the sliced videos and GIFs of one event chunk to the video's record
+    :param record_id:          DynamoDB id of the original video
+    :param job_id:             Segment detection job the chunk belongs to
+    :param chunk:              Chunk manifest with index and count
+    :param s3Bucket:           Bucket of the sliced files
+    :param sliced_video_list:  Sliced video keys of this chunk
+    :param sliced_gif_list:    Sliced GIF keys of this chunk
+    :return:                   True if applied, False if the chunk was applied before
+    """
+    names = {
+        '#slicedVideos': 'slicedVideos',
+        '#slicedGifs': 'slicedGifs',
+        '#s3Bucket': 's3Bucket',
+        '#segmentsJobId': 'segmentsJobId',
+        '#chunkCount': 'chunkCount',
+        '#appliedChunks': 'appliedChunks'
+    }
+    values = {
+        ':slicedVideos': sliced_video_list,
+        ':slicedGifs': sliced_gif_list,
+        ':s3Bucket': s3Bucket,
+        ':jobId': job_id,
+        ':chunkCount': chunk['count'],
+        ':chunks': {str(chunk['index'])}
+    }
+    # later chunks of the job the record holds: append, unless this chunk is already in appliedChunks
+    append = dict(
+        UpdateExpression="set #slicedVideos = list_append(#slicedVideos, :slicedVideos), "
+                         "#slicedGifs = list_append(#slicedGifs, :slicedGifs), #s3Bucket = :s3Bucket, #chunkCount = :chunkCount "
+                         "add #appliedChunks :chunks",
+        ConditionExpression="#segmentsJobId = :jobId AND NOT contains(#appliedChunks, :chunk)",
+        ExpressionAttributeValues=dict(values, **{':chunk': str(chunk['index'])})
+    )
+    # first chunk of a new job: replace the lists left by any earlier job
+    replace = dict(
+        UpdateExpression="set #slicedVideos = :slicedVideos, #slicedGifs = :slicedGifs, #s3Bucket = :s3Bucket, "
+                         "#segmentsJobId = :jobId, #chunkCount = :chunkCount, #appliedChunks = :chunks",
+        ConditionExpression="attribute_not_exists(#segmentsJobId) OR #segmentsJobId <> :jobId",
+        ExpressionAttributeValues=values
+    )
+    # a concurrent chunk may start the job between our two attempts, so append once more
+    for update in (append, replace, append):
         try:
-            table.update_item(
-                Key={
-                # Strip -iframe-output to restore original video name, 'SampleVideo_1280x720_30mb-iframe-output.mp4' to 'SampleVideo_1280x720_30mb.mp4'
-                'id': s3Object.split('.')[0].rsplit('-')[0] + '.' + s3Object.split('.')[1]
-            },
-            UpdateExpression="set #slicedVideos = :slicedVideos, #slicedGifs = :slicedGifs, #s3Bucket = :s3Bucket",
-            ExpressionAttributeNames={
-                '#slicedVideos': 'slicedVideos',
-                '#slicedGifs': 'slicedGifs',
-                '#s3Bucket': 's3Bucket'
-            },
+            item = table.update_item(Key={'id': record_id}, ExpressionAttributeNames=names, ReturnValues='ALL_NEW', **update)['Attributes']
+            logger.info("Updated sliced video and GIF info of chunk {} of {} to DynamoDB".format(chunk['index'] + 1, chunk['count']))
+            copy_to_duplicates(item)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+    logger.info("Chunk {} of job {} was already applied, skipping".format(chunk['index'], job_id))
+    return False
+
+def copy_to_duplicates(item):
+    """
+    Copy the sliced lists of a record to the records of later uploads of the same content, see meta.py save_duplicate_record
+    :param item:  Record of the original video as updated by save_sliced_lists
+    """
+    for duplicate in item.get('duplicates', ()):
+        table.update_item(
+            Key={'id': duplicate},
+            UpdateExpression="set slicedVideos = :slicedVideos, slicedGifs = :slicedGifs, s3Bucket = :s3Bucket, "
+                             "segmentsJobId = :jobId, chunkCount = :chunkCount, appliedChunks = :chunks",
             ExpressionAttributeValues={
-                ':slicedVideos': sliced_video_list,
-                ':slicedGifs': sliced_gif_list,
-                ':s3Bucket': s3Bucket
+                ':slicedVideos': item['slicedVideos'],
+                ':slicedGifs': item['slicedGifs'],
+                ':s3Bucket': item['s3Bucket'],
+                ':jobId': item['segmentsJobId'],
+                ':chunkCount': item['chunkCount'],
+                ':chunks': item['appliedChunks']
             }
         )
-            logger.info("Updated sliced video and GIF info to DynamoDB")
-        except Exception as e:
-            logger.error("Error: {}, return code {}".format(e.output.decode('utf-8'), e.returncode))
-            logger.error("Failed to update sliced video and GIF info to DynamoDB")
+        logger.info("Copied sliced video and GIF info to duplicate {}".format(duplicate))
 
 def get_signed_url(expires_in, bucket, obj):
     """
@@ -162,8 +544,7 @@ def get_signed_url(expires_in, bucket, obj):
     :param obj:         S3 Key name
     :return:            Signed URL
     """
-    s3_cli = boto3.client("s3")
-    presigned_url = s3_cli.generate_presigned_url('get_object', Params={'Bucket': bucket, 'Key': obj}, ExpiresIn=expires_in)
+    presigned_url = s3.generate_presigned_url('get_object', Params={'Bucket': bucket, 'Key': obj}, ExpiresIn=expires_in)
     return presigned_url
 
 def upload_file(file_name, bucket, object_name=None):
@@ -0,0 +1,99 @@
+import logging
+import os
+import shutil
+import tempfile
+
+# Each Lambda image is built from its own directory, keep the copies of this file in meta/ and event/ identical (checked by tests/test_shared_modules.py)
+
+logger = logging.getLogger('boto3')
+
+SCRATCH_ROOT = '/tmp'
+SCRATCH_PREFIX = 'scratch-'
+# ephemeral storage configured for the function, /tmp is 512 MB unless raised
+EPHEMERAL_STORAGE_BYTES = int(os.environ.get('EPHEMERAL_STORAGE_MB', 512)) * 1024 * 1024
+
+class ScratchSpace:
+    """
+    Per-invocation scratch directory under /tmp with a byte budget.
+
+    Every file an invocation writes goes into its own directory, which is removed
+    on any exit, so a failed invocation cannot leave files behind that fill /tmp
+    for the next ones in a warm container. Directories left by an invocation that
+    was killed before cleanup (timeout, out of memory) are swept on entry; a
+    container only runs one invocation at a time, so none of them is in use.
+
+    Large files are reserved against the budget before they are written, so
+    callers can stream instead when they would not fit.
+    """
+
+    def __init__(self, root=SCRATCH_ROOT, budget_bytes=EPHEMERAL_STORAGE_BYTES):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.directory = None
+        # path -> reserved bytes
+        self.reserved = {}
+
+    def __enter__(self):
+        self.sweep()
+        self.directory = tempfile.mkdtemp(prefix=SCRATCH_PREFIX, dir=self.root)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.reserved = {}
+        return False
+
+    def sweep(self):
+        """
+        Remove scratch directories of earlier invocations
+        """
+        for name in os.listdir(self.root):
+            if name.startswith(SCRATCH_PREFIX):
+                logger.warning("Removing stale scratch directory {}".format(name))
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+    def path(self, name):
+        """
+        Path for a file in the scratch directory
+        :param name:  File name, may contain '/' like S3 keys
+        :return:      Absolute path, parent directories are created
+        """
+        path = os.path.join(self.directory, name.lstrip('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def mkdtemp(self):
+        """
+        Create a fresh directory inside the scratch directory
+        """
+        return tempfile.mkdtemp(dir=self.directory)
+
+    def available(self):
+        """
+        Bytes that can still be reserved, bounded by both the budget and the free disk space
+        """
+        free = shutil.disk_usage(self.root).free
+        return max(0, min(self.budget_bytes - sum(self.reserved.values()), free))
+
+    def reserve(self, path, size):
+        """
+        Reserve space for a file about to be written
+        :param path:  Scratch path of the file
+        :param size:  Expected size in bytes
+        :return:      True if it fits, nothing is reserved otherwise
+        """
+        if size > self.available() + self.reserved.get(path, 0):
+            logger.info("{} bytes for {} do not fit in scratch space, {} available".format(size, path, self.available()))
+            return False
+        self.reserved[path] = size
+        return True
+
+    def release(self, path):
+        """
+        Remove a file or directory early and return its reservation
+        """
+        self.reserved.pop(path, None)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
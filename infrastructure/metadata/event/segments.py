@@ -0,0 +1,48 @@
+import struct
+
+# processor.py writes and event.py reads this format, keep the copies of this file in processor/ and event/ identical (checked by tests/test_shared_modules.py)
+
+# Claim-check file of SHOT segments, all little endian:
+#   header  b'SEGS', uint16 version, uint32 segment count
+#   columns uint32 startTimestampMillis[count], uint32 endTimestampMillis[count], uint32 durationMillis[count]
+SEGMENTS_MAGIC = b'SEGS'
+SEGMENTS_VERSION = 1
+HEADER = struct.Struct('<4sHI')
+COLUMNS = ('startTimestampMillis', 'endTimestampMillis', 'durationMillis')
+
+def pack_segments(segments_meta):
+    """
+    Encode segments into the columnar claim-check format
+    :param segments_meta:  List of segment dicts as in the videoShotsAndGif event detail
+    :return:               bytes, 12 bytes per segment plus a 10 byte header
+    """
+    count = len(segments_meta)
+    data = [HEADER.pack(SEGMENTS_MAGIC, SEGMENTS_VERSION, count)]
+    for column in COLUMNS:
+        data.append(struct.pack('<{}I'.format(count), *(segment[column] for segment in segments_meta)))
+    return b''.join(data)
+
+def unpack_segments(data):
+    """
+    Decode a claim-check file back into segment dicts
+    :param data:  bytes written by pack_segments
+    :return:      List of segment dicts as in the videoShotsAndGif event detail, without the SMPTE timecodes
+                  which are not stored; slicing only uses the millisecond fields
+    """
+    magic, version, count = HEADER.unpack_from(data)
+    if magic != SEGMENTS_MAGIC or version != SEGMENTS_VERSION:
+        raise ValueError("Unsupported segments file: magic {}, version {}".format(magic, version))
+    columns = {}
+    offset = HEADER.size
+    for column in COLUMNS:
+        columns[column] = struct.unpack_from('<{}I'.format(count), data, offset)
+        offset += 4 * count
+
+    segments_meta = []
+    for start, end, duration in zip(*(columns[column] for column in COLUMNS)):
+        segments_meta.append({
+            'startTimestampMillis': start,
+            'endTimestampMillis': end,
+            'durationMillis': duration
+        })
+    return segments_meta
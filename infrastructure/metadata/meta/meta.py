@@ -1,27 +1,92 @@
 import logging
 import subprocess
-import uuid
-import boto3
 import os
-import json
-import sys
-import math
-import PIL.Image as Image
-
+import time
+import hashlib
+import gzip
+import xml.etree.ElementTree as ElementTree
+import struct
+import threading
+
+from collections import deque
+from decimal import Decimal, InvalidOperation
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 
-s3 = boto3.client('s3')
-rek = boto3.client('rekognition')
-sqs = boto3.client('sqs')
+from clients import lazy_client, lazy_table
+from scratch import ScratchSpace
+
+# numpy and PIL are imported where frames are scored, duplicate uploads never need them
+
+s3 = lazy_client('s3')
+rek = lazy_client('rekognition')
+sqs = lazy_client('sqs')
 
 dynamoDBTableName = "metaData"
-dynamodb = boto3.resource("dynamodb")
-dynamoDBTable = dynamodb.Table(dynamoDBTableName)
+dynamoDBTable = lazy_table(dynamoDBTableName)
+# fingerprint -> first key uploaded with that content, see fingerprint_object
+fingerprintTable = lazy_table(os.environ.get('FINGERPRINT_TABLE', 'videoFingerprints'))
 
 startJobId = ''
 
-SIGNED_URL_EXPIRATION = 300
-LOCAL_VIDEO_FILE = '/tmp/'+ 'local-input.mp4'
+# streamed input is read through the URL again for the cover at the end of the decode, so it lasts the longest Lambda run
+SIGNED_URL_EXPIRATION = 15 * 60
+LOCAL_VIDEO_NAME = 'local-input.mp4'
+
+# S3 transfers run as parallel ranged GETs / multipart uploads of this part size
+TRANSFER_CONCURRENCY = int(os.environ.get('TRANSFER_CONCURRENCY', 8))
+TRANSFER_PART_SIZE = int(os.environ.get('TRANSFER_PART_MB', 16)) * 1024 * 1024
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=TRANSFER_PART_SIZE, multipart_chunksize=TRANSFER_PART_SIZE,
+                                 max_concurrency=TRANSFER_CONCURRENCY, use_threads=True)
+# 'stream' feeds faststart MP4 input to ffmpeg while it downloads, 'download' lands it in scratch space first
+INPUT_MODE = os.environ.get('INPUT_MODE', 'download')
+# containers that ffmpeg can only read from a pipe when the moov box comes first
+FASTSTART_EXTENSIONS = ('mp4', 'm4v', 'mov')
+
+# 's3' stores the raw mediainfo XML gzipped in the processed bucket, 'inline' in the record as before, 'off' drops it
+RAW_METADATA_MODE = os.environ.get('RAW_METADATA_MODE', 's3')
+RAW_METADATA_PREFIX = 'metadata/'
+MEDIAINFO_NAMESPACE = '{https://mediaarea.net/mediainfo}'
+# record attribute -> (mediainfo track type, field, type), from the first track of that type
+MEDIAINFO_FIELDS = {
+    'container': ('General', 'Format', str),
+    'durationMillis': ('General', 'Duration', 'millis'),
+    'fileSize': ('General', 'FileSize', int),
+    'bitRate': ('General', 'OverallBitRate', int),
+    'videoCount': ('General', 'VideoCount', int),
+    'audioCount': ('General', 'AudioCount', int),
+    'textCount': ('General', 'TextCount', int),
+    'videoCodec': ('Video', 'Format', str),
+    'width': ('Video', 'Width', int),
+    'height': ('Video', 'Height', int),
+    'frameRate': ('Video', 'FrameRate', Decimal),
+    'videoBitRate': ('Video', 'BitRate', int),
+    'audioCodec': ('Audio', 'Format', str),
+    'audioSampleRate': ('Audio', 'SamplingRate', int),
+    'audioChannels': ('Audio', 'Channels', int),
+    'audioBitRate': ('Audio', 'BitRate', int),
+}
+
+# number and size of the ranges hashed into the content fingerprint
+FINGERPRINT_SAMPLES = 8
+FINGERPRINT_SAMPLE_SIZE = 64 * 1024
+# a claim still processing after the longest possible Lambda run belongs to an invocation that died
+FINGERPRINT_CLAIM_TIMEOUT = 15 * 60
+
+# 'stream' pipes raw frames from ffmpeg into the scorer, 'file' scores JPEG snapshots written to scratch space
+COVER_MODE = os.environ.get('COVER_MODE', 'stream')
+SNAPSHOT_FPS = '0.1'
+# x264 preset of the all-intra copy, e.g. 'veryfast'; ffmpeg's default when unset
+INTRA_PRESET = os.environ.get('INTRA_PRESET')
+# all-intra at -qscale 0 is several times the size of the source, this much is reserved for it in scratch space
+INTRA_SIZE_RATIO = float(os.environ.get('INTRA_SIZE_RATIO', 4))
+# fragment length of an intra copy uploaded from a pipe, in microseconds
+INTRA_FRAGMENT_DURATION = 2 * 1000 * 1000
+# snapshots are scored at roughly this size, see frame_histogram and imageWithMaxEntropyFromPipe
+ENTROPY_DRAFT_SIZE = (160, 90)
+ENTROPY_WORKERS = int(os.environ.get('ENTROPY_WORKERS', os.cpu_count() or 1))
 
 LAMBDA_TASK_ROOT = os.environ.get('LAMBDA_TASK_ROOT')
 # ffmpeg_path = os.path.join(LAMBDA_TASK_ROOT, 'ffmpeg')
@@ -32,7 +97,13 @@ logger.setLevel(logging.INFO)
 # add execution path to ffmpeg
 os.environ['PATH'] = os.environ['PATH'] + ':' + os.environ['LAMBDA_TASK_ROOT']
 
+class DecodeError(Exception):
+    """
+    ffmpeg failed, or its streamed input was cut short
+    """
+
 # testing with command aws s3 rm s3://metadata-original-video/SampleVideo_1280x720_30mb.mp4 && aws s3 cp SampleVideo_1280x720_30mb.mp4 s3://metadata-original-video/
+# (every put has a new event sequencer, so re-uploading the same file under the same key processes it again)
 def lambda_handler(event, context):
     """
 
@@ -40,83 +111,159 @@ def lambda_handler(event, context):
     :param context:
     """
     # Loop through records provided by S3 Event trigger, add for API Gateway invocation in future
-    for s3_record in event['Records']:
-        logger.info("Working on new s3_record...")
-        # Extract the Key and Bucket names for the asset uploaded to S3
-        key = s3_record['s3']['object']['key']
-        bucket = s3_record['s3']['bucket']['name']
-        # Generate a signed URL for the uploaded asset
-        signed_url = get_signed_url(SIGNED_URL_EXPIRATION, bucket, key)
-        logger.info("original video bucket: {}, key: {}, signed URL: {}".format(bucket, key, signed_url))
-
-        # Launch MediaInfo CLI to extract metadata
-        # use ffprobe to fetch metadata (frame number)
-        # ffprobe -v error -count_frames -select_streams v:0   -show_entries stream=nb_read_frames -of default=nokey=1:noprint_wrappers=1 SampleVideo_1280x720_30mb.mp4 
-
-        xml_output = subprocess.check_output(["./mediainfo", "--full", "--output=XML", signed_url])
-        logger.info("mediainfo output: {}".format(xml_output))
-
-        # save metadata to DynamoDB
-        save_record(key, xml_output.decode('utf-8'))
-
-        # command refer to https://www.jianshu.com/p/cf1e61eb6fc8
-        # ffmpeg -i SampleVideo_1280x720_30mb.mp4 -strict -2 -qscale 0 -intra keyoutput.mp4
-
-        # #!/bin/sh
-        # for f in ./raw_files/*.mp3; do echo "file '$f'" >> mylist.txt; done
-        # printf "file '%s'\n" ./raw_files/*.mp3 > mylist.txt        
-
-        # ffmpeg -ss 00:01:00 -t 00:00:10 -i keyoutput.mp4 -vcodec copy -acodec copy output1.mp4
-        # ffmpeg -ss 00:02:00 -t 00:00:10 -i keyoutput.mp4 -vcodec copy -acodec copy output2.mp4
-
-        # #!/bin/sh
-        # output=$1
-        # echo writing to $output
-        # ffmpeg -f concat -safe 0 -i mylist.txt -c copy $output
-
-        # Download the asset to a local file
-        s3.download_file(bucket, key, LOCAL_VIDEO_FILE)
-
-        # Run ffmpeg to transform I-Frames, keep video suffix unchanged
-        IFRAME_VIDEO_FILE = '/tmp/'+ key.split('.')[0] + '-iframe-output.' + key.split('.')[1]
-        CMD = ['ffmpeg', '-y', '-i', LOCAL_VIDEO_FILE, '-strict', '-2', '-qscale', '0', '-intra', IFRAME_VIDEO_FILE]
-        SHELL_CMD = ' '.join(CMD)
-        try:
-            # out_bytes = subprocess.check_output(['./ffmpeg', '-y', '-i', LOCAL_VIDEO_FILE, '-strict', '-2', '-qscale', '0', '-intra', IFRAME_VIDEO_FILE])
-            out_bytes = subprocess.check_output(SHELL_CMD, shell=True)
-        except subprocess.CalledProcessError as e:
-            logger.error("Error: {}, return code {}".format(e.output.decode('utf-8'), e.returncode))
-
-        # Upload the transformed I-Frames to S3
-        upload_file(IFRAME_VIDEO_FILE, os.environ.get('Processed_Bucket'))
-        logger.info("Uploaded transformed I-Frames {} to S3".format(IFRAME_VIDEO_FILE))
-
-        # run ffmpeg to snapshot video in 5 second intervals
+    # Every file of this invocation lives in its scratch directory, which is removed however the invocation ends
+    with ScratchSpace() as scratch:
+        for s3_record in event['Records']:
+            logger.info("Working on new s3_record...")
+            # Extract the Key and Bucket names for the asset uploaded to S3
+            key = s3_record['s3']['object']['key']
+            bucket = s3_record['s3']['bucket']['name']
+            # orders the events of one key, only a redelivered event repeats it
+            sequencer = s3_record['s3']['object'].get('sequencer')
+            logger.info("original video bucket: {}, key: {}".format(bucket, key))
+
+            # Skip all heavy work when the same bytes were already uploaded under another key; while that upload
+            # is still processing, it saves this key's record once it is done
+            fingerprint = fingerprint_object(bucket, key)
+            claim = claim_fingerprint(fingerprint, key, sequencer)
+            if claim is not None:
+                if claim['id'] == key:
+                    logger.info("{} was already processed, skipping the redelivered event".format(key))
+                elif claim['status'] == 'done':
+                    save_duplicate_record(key, claim['id'])
+                    logger.info("{} has the same content as {}, skipping processing".format(key, claim['id']))
+                else:
+                    logger.info("{} has the same content as {}, which saves its record once processed".format(key, claim['id']))
+                continue
+
+            # a claim left at 'processing' would hold back every later upload of this content until it goes stale
+            try:
+                decoded = process_video(bucket, key, scratch)
+            except Exception:
+                release_fingerprint(fingerprint, key)
+                raise
+
+            # later uploads of the same content can reuse this key's artifacts from now on
+            if decoded:
+                complete_fingerprint(fingerprint, key)
+            else:
+                release_fingerprint(fingerprint, key)
+
+def process_video(bucket, key, scratch):
+    """
+    Extract metadata, the all-intra copy and the cover of an uploaded video, then start segment detection on it
+    :param bucket:   Bucket of the original video
+    :param key:      S3 Key name
+    :param scratch:  ScratchSpace of the invocation
+    :return:         False if decoding or streaming the video failed, so its artifacts must not be reused
+    """
+    # command refer to https://www.jianshu.com/p/cf1e61eb6fc8
+    # ffmpeg -i SampleVideo_1280x720_30mb.mp4 -strict -2 -qscale 0 -intra keyoutput.mp4
+
+    # #!/bin/sh
+    # for f in ./raw_files/*.mp3; do echo "file '$f'" >> mylist.txt; done
+    # printf "file '%s'\n" ./raw_files/*.mp3 > mylist.txt        
+
+    # ffmpeg -ss 00:01:00 -t 00:00:10 -i keyoutput.mp4 -vcodec copy -acodec copy output1.mp4
+    # ffmpeg -ss 00:02:00 -t 00:00:10 -i keyoutput.mp4 -vcodec copy -acodec copy output2.mp4
+
+    # #!/bin/sh
+    # output=$1
+    # echo writing to $output
+    # ffmpeg -f concat -safe 0 -i mylist.txt -c copy $output
+
+    # Either stream the asset into ffmpeg as it downloads, or download it to a local file first;
+    # assets that do not fit in scratch space are streamed when possible
+    feed = None
+    LOCAL_VIDEO_FILE = scratch.path(LOCAL_VIDEO_NAME)
+    input_size = s3.head_object(Bucket=bucket, Key=key)['ContentLength']
+    fits = scratch.reserve(LOCAL_VIDEO_FILE, input_size)
+    if (INPUT_MODE == 'stream' or not fits) and isFastStart(bucket, key):
+        logger.info("Streaming {} into ffmpeg".format(key))
+        scratch.release(LOCAL_VIDEO_FILE)
+        # mediainfo only reads the headers through the signed URL, and the cover is grabbed through it
+        media_source = get_signed_url(SIGNED_URL_EXPIRATION, bucket, key)
+        video_input = 'pipe:0'
+        feed = lambda pipe: streamObject(bucket, key, pipe)
+    else:
+        if not fits:
+            logger.warning("{} may not fit in scratch space and cannot be streamed, downloading anyway".format(key))
+        s3.download_file(bucket, key, LOCAL_VIDEO_FILE, Config=TRANSFER_CONFIG)
+        media_source = video_input = LOCAL_VIDEO_FILE
+
+    # Launch MediaInfo CLI to extract metadata, it only parses the container
+    # use ffprobe to fetch metadata (frame number)
+    # ffprobe -v error -count_frames -select_streams v:0   -show_entries stream=nb_read_frames -of default=nokey=1:noprint_wrappers=1 SampleVideo_1280x720_30mb.mp4 
+
+    xml_output = subprocess.check_output(["./mediainfo", "--full", "--output=XML", media_source])
+    logger.info("mediainfo output: {}".format(xml_output))
+
+    # save metadata to DynamoDB
+    save_record(key, xml_output.decode('utf-8'))
+
+    # Run ffmpeg once to transform I-Frames (keep video suffix unchanged) and snapshot video in 10 second
+    # intervals from the same decode, then pick the snapshot with most entropy as video cover
+    IFRAME_VIDEO_FILE = scratch.path(key.split('.')[0] + '-iframe-output.' + key.split('.')[1])
+    # the intra copy is uploaded as ffmpeg writes it when it would not fit in scratch space
+    intra_output = IFRAME_VIDEO_FILE
+    intra_upload = None
+    if not scratch.reserve(IFRAME_VIDEO_FILE, int(input_size * INTRA_SIZE_RATIO)):
+        logger.info("Uploading the intra copy of {} while it is encoded".format(key))
+        intra_output, intra_upload = uploadFromPipe(os.environ.get('Processed_Bucket'), os.path.basename(IFRAME_VIDEO_FILE))
+    # a truncated intra copy must not be reused for later uploads of the same content
+    decoded = True
+    if COVER_MODE == 'file':
         # ffmpeg -i SampleVideo_1280x720_30mb.mp4 -vf fps=0.1 key-snapshot-output-%d.jpeg
-        SNAPSHOT_VIDEO_FILE = '/tmp/'+ key.split('.')[0] + '-snapshot-output-%d' + '.jpeg'
-        CMD = ['ffmpeg', '-y', '-i', LOCAL_VIDEO_FILE, '-vf', 'fps=0.1', SNAPSHOT_VIDEO_FILE]
-        SHELL_CMD = ' '.join(CMD)
+        # snapshots go to a directory of their own, so only this video's snapshots are scored
+        snapshot_dir = scratch.mkdtemp()
+        SNAPSHOT_VIDEO_FILE = os.path.join(snapshot_dir, os.path.basename(key.split('.')[0]) + '-snapshot-output-%d' + '.jpeg')
+        CMD = decodeCommand(video_input, intra_output, 'fps=' + SNAPSHOT_FPS, [SNAPSHOT_VIDEO_FILE])
+        process, feeder = startFfmpeg(CMD, feed)
+        output = process.stdout.read()
         try:
-            subprocess.check_output(SHELL_CMD, shell=True)
-        except subprocess.CalledProcessError as e:
-            logger.error("Error: {}, return code {}".format(e.output.decode('utf-8'), e.returncode))
+            finishFfmpeg(process, feeder, output)
+        except DecodeError as e:
+            logger.error("Decoding {} failed: {}".format(key, e))
+            decoded = False
+        VIDEO_COVER = imageWithMaxEntropy(snapshot_dir)
+    else:
+        try:
+            VIDEO_COVER = imageWithMaxEntropyFromPipe(video_input, scratch.path(key.split('.')[0] + '-cover.jpeg'), intra_output, feed, media_source)
+        except DecodeError as e:
+            logger.error("Decoding {} failed: {}".format(key, e))
+            decoded = False
+            VIDEO_COVER = None
+
+    # Upload the transformed I-Frames to S3
+    if intra_upload:
+        decoded = intra_upload.result() and decoded
+    else:
+        upload_file(IFRAME_VIDEO_FILE, os.environ.get('Processed_Bucket'))
+        scratch.release(IFRAME_VIDEO_FILE)
+    logger.info("Uploaded transformed I-Frames {} to S3".format(IFRAME_VIDEO_FILE))
 
-        # calculate image with most entropy and upload to S3 as video cover
-        VIDEO_COVER = imageWithMaxEntropy()
-        logger.info("Video cover: {}".format(VIDEO_COVER))
+    logger.info("Video cover: {}".format(VIDEO_COVER))
+    if VIDEO_COVER:
         upload_file(VIDEO_COVER, os.environ.get('Processed_Bucket'))
-        logger.info("Uploaded video cover {} to S3".format(SNAPSHOT_VIDEO_FILE))
-
-        # remove local file
-        os.remove(LOCAL_VIDEO_FILE)
+        logger.info("Uploaded video cover {} to S3".format(VIDEO_COVER))
+    if COVER_MODE == 'file':
+        scratch.release(snapshot_dir)
+    elif VIDEO_COVER:
+        scratch.release(VIDEO_COVER)
+
+    # remove local file
+    if feed is None:
+        scratch.release(LOCAL_VIDEO_FILE)
         logger.info("Removed local file {}".format(LOCAL_VIDEO_FILE))
 
-        bucketProcessed = os.environ.get('Processed_Bucket')
-        keyProcessed = os.path.basename(IFRAME_VIDEO_FILE)
-        logger.info("bucketProcessed: {}, keyProcessed: {}".format(bucketProcessed, keyProcessed))
+    bucketProcessed = os.environ.get('Processed_Bucket')
+    keyProcessed = os.path.basename(IFRAME_VIDEO_FILE)
+    logger.info("bucketProcessed: {}, keyProcessed: {}".format(bucketProcessed, keyProcessed))
 
-        # invoke rekognition to fetch tech cue and shot info
-        StartSegmentDetection(bucket = str(bucketProcessed), key = str(keyProcessed))
+    # invoke rekognition to fetch tech cue and shot info
+    StartSegmentDetection(bucket = str(bucketProcessed), key = str(keyProcessed))
+
+    return decoded
 
 def upload_file(file_name, bucket, object_name=None):
     """Upload a file to an S3 bucket
@@ -133,7 +280,7 @@ def upload_file(file_name, bucket, object_name=None):
 
     # Upload the file
     try:
-        response = s3.upload_file(file_name, bucket, object_name)
+        response = s3.upload_file(file_name, bucket, object_name, Config=TRANSFER_CONFIG)
     except ClientError as e:
         logging.error(e)
         return False
@@ -147,13 +294,229 @@ def save_record(key, xml_output):
     :return:
     """
     logger.info("Saving record to DynamoDB...")
-    dynamoDBTable.put_item(
-       Item={
-            'id': key,
-            'metaData': xml_output
-        }
+    item = parse_mediainfo(xml_output)
+    item['id'] = key
+    if RAW_METADATA_MODE == 'inline':
+        item['metaData'] = xml_output
+    elif RAW_METADATA_MODE == 's3':
+        item['metaDataObject'] = save_raw_metadata(key, xml_output)
+    dynamoDBTable.put_item(Item=item)
+    logger.info("Saved record to DynamoDB: {}".format(item))
+
+def parse_mediainfo(xml_output):
+    """
+    Extract the MEDIAINFO_FIELDS attributes from mediainfo XML output
+    :param xml_output:  Metadata in XML Format
+    :return:            Dict of record attributes, fields missing from the output are left out
+    """
+    try:
+        root = ElementTree.fromstring(xml_output)
+    except ElementTree.ParseError as e:
+        logger.error("Could not parse mediainfo output: {}".format(e))
+        return {}
+
+    # first track of each type, with the namespace stripped from the field names
+    tracks = {}
+    for track in root.iter(MEDIAINFO_NAMESPACE + 'track'):
+        if track.get('type') not in tracks:
+            tracks[track.get('type')] = {field.tag.replace(MEDIAINFO_NAMESPACE, ''): field.text for field in track}
+
+    item = {}
+    for attribute, (track_type, field, field_type) in MEDIAINFO_FIELDS.items():
+        value = tracks.get(track_type, {}).get(field)
+        if value is None:
+            continue
+        try:
+            if field_type == 'millis':
+                # mediainfo reports durations in seconds
+                item[attribute] = int(Decimal(value) * 1000)
+            elif field_type is int:
+                item[attribute] = int(Decimal(value))
+            else:
+                # DynamoDB takes Decimal rather than float for non-integer numbers
+                item[attribute] = field_type(value)
+        except (InvalidOperation, ValueError):
+            logger.warning("Unexpected mediainfo {} {}: {}".format(track_type, field, value))
+    return item
+
+def save_raw_metadata(key, xml_output):
+    """
+    Store the raw mediainfo XML gzipped in the processed bucket
+    :param key:         S3 Key Name of the video
+    :param xml_output:  Metadata in XML Format
+    :return:            S3 Key Name of the stored XML
+    """
+    bucket = os.environ.get('Processed_Bucket')
+    object_name = RAW_METADATA_PREFIX + key + '.xml.gz'
+    s3.put_object(Bucket=bucket, Key=object_name, Body=gzip.compress(xml_output.encode('utf-8')),
+                  ContentType='application/xml', ContentEncoding='gzip')
+    logger.info("Saved raw metadata to s3://{}/{}".format(bucket, object_name))
+    return object_name
+
+def fingerprint_object(bucket, key):
+    """
+    Fingerprint the content of an S3 object without downloading it
+    :param bucket:
+    :param key:     S3 Key name
+    :return:        Hex digest over the ETag, the size and FINGERPRINT_SAMPLES ranges spread over the object
+    """
+    head = s3.head_object(Bucket=bucket, Key=key)
+    size = head['ContentLength']
+    digest = hashlib.sha256('{}:{}'.format(head['ETag'], size).encode('utf-8'))
+
+    # evenly spaced ranges including the start and the end of the object
+    last = max(0, size - FINGERPRINT_SAMPLE_SIZE)
+    starts = sorted(set(last * i // max(1, FINGERPRINT_SAMPLES - 1) for i in range(FINGERPRINT_SAMPLES)))
+
+    def fetch(start):
+        end = min(start + FINGERPRINT_SAMPLE_SIZE, size) - 1
+        return s3.get_object(Bucket=bucket, Key=key, Range='bytes={}-{}'.format(start, end))['Body'].read()
+
+    if size > 0:
+        with ThreadPoolExecutor(max_workers=len(starts)) as executor:
+            for sample in executor.map(fetch, starts):
+                digest.update(sample)
+    return digest.hexdigest()
+
+def claim_fingerprint(fingerprint, key, sequencer=None):
+    """
+    Register key as the first upload of this content, unless another key got there first
+    :param fingerprint:  Content fingerprint
+    :param key:          S3 Key name
+    :param sequencer:    Sequencer of the S3 event, a new put of key has a new one
+    :return:             None if key should be processed, else the fingerprint item of the key whose artifacts to reuse;
+                         while that key is still processing, key waits in the item's 'waiting' set for complete_fingerprint
+    """
+    try:
+        # conditional put, so of two concurrent uploads of the same content only one is processed
+        fingerprintTable.put_item(
+            Item={
+                'fingerprint': fingerprint,
+                'id': key,
+                'status': 'processing',
+                'createdAt': int(time.time()),
+                'sequencer': sequencer
+            },
+            ConditionExpression='attribute_not_exists(fingerprint)'
+        )
+        return None
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            # dedup is an optimization, never block processing on it
+            logger.error("Fingerprint lookup failed, processing {}: {}".format(key, e))
+            return None
+
+    item = fingerprintTable.get_item(Key={'fingerprint': fingerprint}, ConsistentRead=True).get('Item')
+    if item is None:
+        # the claim was deleted in between, try again
+        return claim_fingerprint(fingerprint, key, sequencer)
+    # a redelivered event of an upload is skipped, a new upload under the same key is processed again
+    if item['status'] == 'done' and (item['id'] != key or (sequencer is not None and item.get('sequencer') == sequencer)):
+        return item
+    pending = item['status'] == 'processing' and int(time.time()) - int(item['createdAt']) < FINGERPRINT_CLAIM_TIMEOUT
+    if pending and item['id'] != key:
+        # the original's record and artifacts do not exist yet, wait for them rather than for an event retry,
+        # Lambda gives up on those long before a large upload is processed
+        try:
+            fingerprintTable.update_item(
+                Key={'fingerprint': fingerprint},
+                UpdateExpression="add waiting :key",
+                ConditionExpression="#id = :id AND #status = :processing",
+                ExpressionAttributeNames={'#id': 'id', '#status': 'status'},
+                ExpressionAttributeValues={':key': {key}, ':id': item['id'], ':processing': 'processing'}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                logger.error("Fingerprint wait failed, processing {}: {}".format(key, e))
+                return None
+            # the original finished, failed or was taken over in between, look again
+            return claim_fingerprint(fingerprint, key, sequencer)
+        return item
+
+    # our own earlier attempt did not finish or is re-uploaded, or the original's failed or died:
+    # claim it unless another upload did first
+    try:
+        fingerprintTable.update_item(
+            Key={'fingerprint': fingerprint},
+            UpdateExpression="set #id = :id, #status = :processing, createdAt = :now, sequencer = :sequencer",
+            ConditionExpression="createdAt = :createdAt AND #status = :status",
+            ExpressionAttributeNames={'#id': 'id', '#status': 'status'},
+            ExpressionAttributeValues={':id': key, ':processing': 'processing', ':now': int(time.time()), ':sequencer': sequencer,
+                                       ':createdAt': item['createdAt'], ':status': item['status']}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            logger.error("Fingerprint takeover failed, processing {}: {}".format(key, e))
+            return None
+        return claim_fingerprint(fingerprint, key, sequencer)
+    if item['id'] != key:
+        logger.warning("Took over the {} fingerprint claim of {}".format(item['status'], item['id']))
+    return None
+
+def complete_fingerprint(fingerprint, key):
+    """
+    Mark the content as fully processed and save the records of the duplicates that waited for it
+    :param fingerprint:  Content fingerprint
+    :param key:          S3 Key name that holds the claim
+    """
+    try:
+        # the waiting set is read and cleared in the same update, a duplicate arriving later sees 'done' instead
+        item = fingerprintTable.update_item(
+            Key={'fingerprint': fingerprint},
+            UpdateExpression="set #status = :done remove waiting",
+            ConditionExpression="#id = :id",
+            ExpressionAttributeNames={'#id': 'id', '#status': 'status'},
+            ExpressionAttributeValues={':id': key, ':done': 'done'},
+            ReturnValues='ALL_OLD'
+        )['Attributes']
+    except ClientError as e:
+        logger.error("Failed to complete fingerprint {}: {}".format(fingerprint, e))
+        return
+    for duplicate in item.get('waiting', ()):
+        save_duplicate_record(duplicate, key)
+
+def release_fingerprint(fingerprint, key):
+    """
+    Give up the claim on the content after processing failed; the next upload of it, or a retry of this one,
+    is processed itself and saves the records of the duplicates still waiting
+    :param fingerprint:  Content fingerprint
+    :param key:          S3 Key name that holds the claim
+    """
+    try:
+        item = fingerprintTable.update_item(
+            Key={'fingerprint': fingerprint},
+            UpdateExpression="set #status = :failed",
+            ConditionExpression="#id = :id AND #status = :processing",
+            ExpressionAttributeNames={'#id': 'id', '#status': 'status'},
+            ExpressionAttributeValues={':id': key, ':processing': 'processing', ':failed': 'failed'},
+            ReturnValues='ALL_NEW'
+        )['Attributes']
+    except ClientError as e:
+        logger.error("Failed to release fingerprint {}: {}".format(fingerprint, e))
+        return
+    if item.get('waiting'):
+        logger.error("Processing {} failed, waiting uploads of the same content get no record until it is processed: {}".format(
+            key, ', '.join(sorted(item['waiting']))))
+
+def save_duplicate_record(key, original):
+    """
+    Save a record for a duplicate upload that reuses the original's metadata and artifacts
+    :param key:       S3 Key Name of the duplicate
+    :param original:  S3 Key Name of the first upload with the same content
+    """
+    logger.info("Saving duplicate record of {} to DynamoDB...".format(original))
+    # listed on the original first, so event.py copies the sliced videos and GIFs it adds from now on
+    # (see save_sliced_lists); the ones added before are in the copy below
+    dynamoDBTable.update_item(
+        Key={'id': original},
+        UpdateExpression="add duplicates :key",
+        ExpressionAttributeValues={':key': {key}}
     )
-    logger.info("Saved record to DynamoDB")
+    item = dynamoDBTable.get_item(Key={'id': original}, ConsistentRead=True).get('Item', {})
+    item.pop('duplicates', None)
+    item.update({'id': key, 'duplicateOf': original})
+    dynamoDBTable.put_item(Item=item)
+    logger.info("Saved duplicate record to DynamoDB")
 
 def get_signed_url(expires_in, bucket, obj):
     """
@@ -163,10 +526,102 @@ def get_signed_url(expires_in, bucket, obj):
     :param obj:         S3 Key name
     :return:            Signed URL
     """
-    s3_cli = boto3.client("s3")
-    presigned_url = s3_cli.generate_presigned_url('get_object', Params={'Bucket': bucket, 'Key': obj}, ExpiresIn=expires_in)
+    presigned_url = s3.generate_presigned_url('get_object', Params={'Bucket': bucket, 'Key': obj}, ExpiresIn=expires_in)
     return presigned_url
 
+def uploadFromPipe(bucket, object_name):
+    """
+    Multipart upload of what ffmpeg writes to a pipe, for outputs that do not fit in scratch space
+    :param bucket:       Bucket to upload to
+    :param object_name:  S3 object name
+    :return:             ('pipe:N' output for ffmpeg, Future that is True once uploaded)
+    """
+    read_fd, write_fd = os.pipe()
+
+    def upload():
+        with os.fdopen(read_fd, 'rb') as pipe:
+            try:
+                s3.upload_fileobj(pipe, bucket, object_name, Config=TRANSFER_CONFIG)
+            except ClientError as e:
+                # closing the pipe makes ffmpeg fail too
+                logging.error(e)
+                return False
+        return True
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    upload_future = executor.submit(upload)
+    executor.shutdown(wait=False)
+    return 'pipe:{}'.format(write_fd), upload_future
+
+def isFastStart(bucket, key):
+    """
+    Check that an MP4 object has its moov box before the media data, so ffmpeg can read it from a pipe
+    :param bucket:
+    :param key:     S3 Key name
+    :return:        True if moov precedes mdat
+    """
+    if key.rsplit('.', 1)[-1].lower() not in FASTSTART_EXTENSIONS:
+        return False
+    size = s3.head_object(Bucket=bucket, Key=key)['ContentLength']
+    offset = 0
+    # walk the top level boxes: ftyp, free, ... until moov or mdat
+    for _ in range(16):
+        if offset + 8 > size:
+            break
+        header = s3.get_object(Bucket=bucket, Key=key, Range='bytes={}-{}'.format(offset, offset + 15))['Body'].read()
+        box_size, box_type = struct.unpack('>I4s', header[:8])
+        if box_size == 1:
+            box_size = struct.unpack('>Q', header[8:16])[0]
+        elif box_size == 0:
+            box_size = size - offset
+        if box_type == b'moov':
+            return True
+        if box_type == b'mdat' or box_size < 8:
+            return False
+        offset += box_size
+    return False
+
+def streamObject(bucket, key, pipe):
+    """
+    Write an S3 object to a pipe using parallel ranged GETs, parts are written in order
+    :param bucket:
+    :param key:     S3 Key name
+    :param pipe:    Writable binary file object, closed when done
+    :raises:        Whatever stopped the object from being written completely
+    """
+    size = s3.head_object(Bucket=bucket, Key=key)['ContentLength']
+
+    def fetch(start):
+        end = min(start + TRANSFER_PART_SIZE, size) - 1
+        return s3.get_object(Bucket=bucket, Key=key, Range='bytes={}-{}'.format(start, end))['Body'].read()
+
+    # at most TRANSFER_CONCURRENCY parts are in flight or buffered at a time
+    window = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=TRANSFER_CONCURRENCY) as executor:
+            try:
+                for start in range(0, size, TRANSFER_PART_SIZE):
+                    window.append(executor.submit(fetch, start))
+                    if len(window) >= TRANSFER_CONCURRENCY:
+                        pipe.write(window.popleft().result())
+                while window:
+                    pipe.write(window.popleft().result())
+            finally:
+                for future in window:
+                    future.cancel()
+    except BrokenPipeError:
+        logger.warning("ffmpeg stopped reading {} before the end".format(key))
+        raise
+    except Exception as e:
+        # ffmpeg sees the end of its input either way, the caller learns from the raised error that it was cut short
+        logger.error("Error streaming {}: {}".format(key, e))
+        raise
+    finally:
+        try:
+            pipe.close()
+        except BrokenPipeError:
+            pass
+
 def StartSegmentDetection(bucket = '', key = ''):
     
     min_Technical_Cue_Confidence = 80.0
@@ -208,63 +663,205 @@ def StartSegmentDetection(bucket = '', key = ''):
     startJobId = response["JobId"]
     print(f"Start Job Id: {startJobId}")
     
-def calc_entropy(img):
-
-    # get the image size
-    width, height = img.size
-    # get the image data
-    px = img.load()
-    # get the image histogram
-    histogram = img.histogram()
-    # get the image histogram size
-    hist_size = sum(histogram)
-    # get the image histogram count
-    histogram_count = [float(h) / hist_size for h in histogram]
-    # get the image entropy
-    entropy = -sum(p * math.log(p, 2) for p in histogram_count if p != 0)
-
-    return entropy
-
-def imageWithMaxEntropy():
-
-    # get the image path
-    root_path = "/tmp/"
-
-    # get the max entropy image
-    max_entropy_image = None
-    max_entropy = 0
+def frame_histogram(image_path):
+    """
+    Histogram of one snapshot decoded at reduced size
+    :param image_path:  Path of the JPEG snapshot
+    :return:            Histogram as returned by PIL, 256 bins per band
+    """
+    import PIL.Image as Image
+    with Image.open(image_path) as img:
+        # JPEG draft mode lets the decoder scale by up to 1/8 in the DCT, so most
+        # of the pixels are never decoded; the histogram shape barely changes
+        img.draft('RGB', ENTROPY_DRAFT_SIZE)
+        return img.convert('RGB').histogram()
+
+def pixel_histogram(frame):
+    """
+    Histogram of an RGB frame in the same layout as PIL's Image.histogram()
+    :param frame:  uint8 array of shape (height, width, 3)
+    :return:       Array of 768 bins, 256 per band
+    """
+    import numpy as np
+    # offset each band into its own range of bins and count all of them in one pass
+    binned = frame.astype(np.uint16) + np.array([0, 256, 512], dtype=np.uint16)
+    return np.bincount(binned.ravel(), minlength=768)
 
-    # get the min entropy image
-    min_entropy_image = None
-    min_entropy = 3
+def calc_entropy(histograms):
+    """
+    Shannon entropy of a batch of image histograms
+    :param histograms:  Array of shape (images, bins)
+    :return:            Entropy in bits for each image
+    """
+    import numpy as np
+    histograms = np.asarray(histograms, dtype=np.float64)
+    probabilities = histograms / histograms.sum(axis=1, keepdims=True)
+    # 0 * log(0) is taken as 0, so empty bins contribute nothing
+    logs = np.log2(probabilities, out=np.zeros_like(probabilities), where=probabilities > 0)
+    return -(probabilities * logs).sum(axis=1)
 
-    # get the most entropy image
-    most_entropy_image = None
-    most_entropy = 0
+def imageWithMaxEntropy(root_path="/tmp/"):
+    import numpy as np
 
     # set image list
-    image_list = []
-
-    # loop all images in current directory
-    for image in os.listdir(root_path):
-        if image.endswith(".jpeg"):
-            image_list.append(image)
-
-    for image in image_list:
-        # get the image path
-        image_path = os.path.join(root_path, image)
-        # get the image
-        img = Image.open(image_path)
-        # caculate the entropy
-        entropy = calc_entropy(img)
-        logger.info("Image: {}, entropy: {}".format(image, entropy))
-        # judge the entropy
-        if entropy > max_entropy:
-            max_entropy = entropy
-            max_entropy_image = image
-        if entropy < min_entropy:
-            min_entropy = entropy
-            min_entropy_image = image
+    image_list = sorted(image for image in os.listdir(root_path) if image.endswith(".jpeg"))
+    if not image_list:
+        return None
+    image_paths = [os.path.join(root_path, image) for image in image_list]
+
+    # decode the images on a thread pool, PIL releases the GIL while decoding;
+    # a process pool is not an option as Lambda provides no /dev/shm
+    with ThreadPoolExecutor(max_workers=ENTROPY_WORKERS) as executor:
+        histograms = list(executor.map(frame_histogram, image_paths))
+
+    # caculate the entropy of all images at once
+    entropies = calc_entropy(histograms)
+    for image, entropy in zip(image_list, entropies):
+        logger.debug("Image: {}, entropy: {}".format(image, entropy))
+
+    max_entropy_image = image_list[int(np.argmax(entropies))]
+    min_entropy_image = image_list[int(np.argmin(entropies))]
+    logger.info("Scored {} images, max entropy {}".format(len(image_list), entropies.max()))
     logger.info("Max entropy image is {}".format(max_entropy_image))
     logger.info("Min entropy image is {}".format(min_entropy_image))
     return os.path.join(root_path, max_entropy_image)
+
+def decodeCommand(video_file, intra_file, snapshot_filter, snapshot_output):
+    """
+    ffmpeg command writing the all-intra copy and the snapshots from a single decode
+    :param video_file:       Local video file
+    :param intra_file:       Path of the intra-coded output, None for snapshots only, or 'pipe:N' from uploadFromPipe
+    :param snapshot_filter:  Filter chain applied to the snapshot branch
+    :param snapshot_output:  Output options and target of the snapshot branch
+    :return:                 Command as a list
+    """
+    CMD = ['ffmpeg', '-y', '-v', 'error', '-i', video_file]
+    if intra_file is None:
+        return CMD + ['-vf', snapshot_filter] + snapshot_output
+    # split the decoded video so both outputs share one decode; -g 1 is what the deprecated -intra stood for
+    CMD += ['-filter_complex', '[0:v:0]split=2[intra][snap];[snap]{}[snapout]'.format(snapshot_filter),
+            '-map', '[intra]', '-map', '0:a?', '-strict', '-2', '-qscale', '0', '-g', '1']
+    if INTRA_PRESET:
+        CMD += ['-preset', INTRA_PRESET]
+    if intra_file.startswith('pipe:'):
+        # fragmented, so the muxer never seeks back to write the moov box; every frame is a keyframe,
+        # so fragments are cut by duration rather than frag_keyframe, and the mfra index closes the file
+        CMD += ['-f', 'mp4', '-movflags', 'empty_moov', '-frag_duration', str(INTRA_FRAGMENT_DURATION)]
+    return CMD + [intra_file, '-map', '[snapout]'] + snapshot_output
+
+def startFfmpeg(CMD, feed=None, stderr=subprocess.STDOUT):
+    """
+    Start ffmpeg with its output on a pipe
+    :param CMD:     ffmpeg command
+    :param feed:    Callable writing the input to the pipe given to it, for 'pipe:0' input
+    :param stderr:  Where stderr goes, merged into the output by default
+    :return:        (process, Future of feed or None)
+    """
+    # outputs on pipes other than stdout, see uploadFromPipe; ffmpeg holds the only write end once started
+    pass_fds = [int(arg[5:]) for arg in CMD if arg.startswith('pipe:') and int(arg[5:]) > 2]
+    try:
+        process = subprocess.Popen(CMD, stdin=subprocess.PIPE if feed else subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE, stderr=stderr, pass_fds=pass_fds)
+    finally:
+        for fd in pass_fds:
+            os.close(fd)
+    feeder = None
+    if feed:
+        executor = ThreadPoolExecutor(max_workers=1)
+        feeder = executor.submit(feed, process.stdin)
+        executor.shutdown(wait=False)
+    return process, feeder
+
+def finishFfmpeg(process, feeder, output):
+    """
+    Wait for ffmpeg and the thread feeding its input
+    :param process:  ffmpeg process from startFfmpeg
+    :param feeder:   Future of its feed, or None
+    :param output:   What ffmpeg wrote to stderr, for the error message
+    :raises DecodeError:  if ffmpeg failed or its input could not be fed completely
+    """
+    returncode = process.wait()
+    error = feeder.exception() if feeder else None
+    if returncode != 0:
+        logger.error("Error: {}, return code {}".format(output.decode('utf-8', 'replace'), returncode))
+        raise DecodeError("ffmpeg return code {}".format(returncode))
+    if error is not None:
+        raise DecodeError("input cut short: {}".format(error))
+
+def snapshotFrames(video_file, width, height, intra_file=None, feed=None):
+    """
+    Snapshot frames decoded by ffmpeg and read from a pipe, nothing is written to disk
+    :param video_file:  Local video file, or 'pipe:0' with feed
+    :param width:       Width the frames are scaled to
+    :param height:      Height the frames are scaled to
+    :param intra_file:  Also write the all-intra copy here from the same decode
+    :param feed:        Callable writing the input to ffmpeg's stdin
+    :return:            Generator of uint8 arrays of shape (height, width, 3)
+    :raises DecodeError:  after the last frame, if ffmpeg failed or its input was cut short
+    """
+    import numpy as np
+    # scale to a fixed size so every frame on the pipe has a known length
+    CMD = decodeCommand(video_file, intra_file, 'fps={},scale={}:{}'.format(SNAPSHOT_FPS, width, height),
+                        ['-f', 'rawvideo', '-pix_fmt', 'rgb24', 'pipe:1'])
+    frame_size = width * height * 3
+    process, feeder = startFfmpeg(CMD, feed, stderr=subprocess.PIPE)
+    # drained on a thread, ffmpeg would block once its messages fill the pipe buffer while we read frames
+    stderr = []
+    drainer = threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+    drainer.start()
+    completed = False
+    try:
+        while True:
+            data = process.stdout.read(frame_size)
+            if len(data) < frame_size:
+                break
+            yield np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+        completed = True
+    finally:
+        if not completed:
+            process.kill()
+        process.stdout.close()
+        drainer.join()
+        process.stderr.close()
+        if not completed:
+            process.wait()
+    # only reached when all frames were read
+    finishFfmpeg(process, feeder, b''.join(stderr))
+
+def imageWithMaxEntropyFromPipe(video_file, cover_file, intra_file=None, feed=None, cover_source=None):
+    """
+    Score snapshot frames as ffmpeg decodes them and save the best one as the cover
+    :param video_file:    Local video file, or 'pipe:0' with feed
+    :param cover_file:    Path to write the cover JPEG to
+    :param intra_file:    Also write the all-intra copy here from the same decode
+    :param feed:          Callable writing the input to ffmpeg's stdin
+    :param cover_source:  File or URL the cover is grabbed from at full size, video_file if not given
+    :return:              cover_file, or None if no frame was decoded
+    """
+    # frames are scored at ENTROPY_DRAFT_SIZE, like draft mode does for JPEG files; the aspect ratio does not
+    # matter for the histogram, and ffmpeg has already rotated them upright
+    width, height = ENTROPY_DRAFT_SIZE
+    max_entropy_index = None
+    max_entropy = -1.0
+    count = 0
+    for frame in snapshotFrames(video_file, width, height, intra_file, feed):
+        entropy = calc_entropy([pixel_histogram(frame)])[0]
+        logger.debug("Frame: {}, entropy: {}".format(count, entropy))
+        if entropy > max_entropy:
+            max_entropy = entropy
+            max_entropy_index = count
+        count += 1
+
+    if max_entropy_index is None:
+        return None
+    logger.info("Scored {} frames, max entropy {} at frame {}".format(count, max_entropy, max_entropy_index))
+
+    # only the winning snapshot is decoded at full size; the fps filter emits snapshot n at n / SNAPSHOT_FPS seconds
+    CMD = ['ffmpeg', '-y', '-v', 'error', '-ss', '{:.3f}'.format(max_entropy_index / float(SNAPSHOT_FPS)),
+           '-i', cover_source or video_file, '-frames:v', '1', '-q:v', '2', cover_file]
+    try:
+        subprocess.run(CMD, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        logger.error("Error: {}, return code {}".format(e.stderr.decode('utf-8'), e.returncode))
+        return None
+    return cover_file
@@ -1,21 +1,29 @@
 import logging
-import subprocess
-import uuid
-import boto3
 import os
 import json
-import sys
 import time
 
 from botocore.exceptions import ClientError, DataNotFoundError
 
-s3 = boto3.client('s3')
-rek = boto3.client('rekognition')
-sqs = boto3.client('sqs')
-event = boto3.client('events')
+from clients import lazy_client, lazy_table
+from segments import pack_segments
 
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(os.environ.get('DYNAMODB_TABLE'))
+s3 = lazy_client('s3')
+rek = lazy_client('rekognition')
+sqs = lazy_client('sqs')
+event = lazy_client('events')
+
+table = lazy_table(os.environ.get('DYNAMODB_TABLE'))
+
+# largest page get_segment_detection returns
+MAX_RESULTS = 1000
+EVENT_SOURCE = 'custom'
+EVENT_DETAIL_TYPE = 'videoShotsAndGif'
+# EventBridge rejects entries above 256 KB
+MAX_EVENT_SIZE = 256 * 1024
+# 'auto' moves the segments to S3 when they do not fit in one event, 'always' does so for every video,
+# 'off' splits them over several events instead
+CLAIM_CHECK = os.environ.get('CLAIM_CHECK', 'auto')
 
 LAMBDA_TASK_ROOT = os.environ.get('LAMBDA_TASK_ROOT')
 # ffmpeg_path = os.path.join(LAMBDA_TASK_ROOT, 'ffmpeg')
@@ -43,7 +51,7 @@ def lambda_handler(event, context):
 
         logger.info('startJobId: {}, status: {}'.format(rekMessage['JobId'], rekMessage['Status']))
         logger.info('receive message from sqsUrl: {} as follows {}'.format(os.environ.get('QUEUE_URL'), json.dumps(sqsResponse)))
-        
+    
         # message validation
         if 'Message' not in sqsResponse:
             logger.error('JobId not found in message')
@@ -51,31 +59,26 @@ def lambda_handler(event, context):
 
         sqs.delete_message(QueueUrl=os.environ.get('QUEUE_URL'), ReceiptHandle=record['receiptHandle'])
 
-        # download iframe from processed s3 bucket
+        # I-Frames video in the processed s3 bucket, event.py reads it; only the shot info is needed here
         s3Object = rekMessage['Video']['S3ObjectName']
         s3Bucket = rekMessage['Video']['S3Bucket']
-        iframePath = '/tmp/' + s3Object
-        s3.download_file(s3Bucket, s3Object, iframePath)
-        logger.info("Download I-Frames {} from S3 {}".format(s3Object, s3Bucket))
 
         # get shot info from reko result
-        GetSegmentDetectionResults(rekMessage['JobId'], s3Object, s3Bucket, iframePath)
+        GetSegmentDetectionResults(rekMessage['JobId'], s3Object, s3Bucket)
 
-        # delete local file
-        os.remove(iframePath)
-        logger.info("Delete local file {}".format(iframePath))
-
-def GetSegmentDetectionResults(jobId, s3Object, s3Bucket, iframePath, maxRetry=10, retryInterval=5, maxResults=10, nextToken=None):
+def GetSegmentDetectionResults(jobId, s3Object, s3Bucket, maxRetry=3, retryInterval=5, maxResults=MAX_RESULTS, nextToken=None):
     paginationToken = ""
     finished = False
     firstTime = True
     # slicedFilelist = []
+    # SHOT segments of all pages, published together once the last page is read
+    segments_meta = []
 
     while finished == False:
         response = rek.get_segment_detection(
             JobId=jobId, MaxResults=maxResults, NextToken=paginationToken
         )
-        logger.info('rekognition response: {}'.format(json.dumps(response)))
+        logger.info('rekognition response: status {}, {} segments'.format(response['JobStatus'], len(response['Segments'])))
         """
         Sample response:
         {
@@ -208,7 +211,6 @@ For extracting a 3-5 minute video from a longer one based on video understanding
             #     print("\nSegments\n--------")
             firstTime = False
 
-        segments_meta = []
         for segment in response['Segments']:
             # print(f"\tDuration (milliseconds): {segment['DurationMillis']}")
             # print(f"\tStart Timestamp (milliseconds): {segment['StartTimestampMillis']}")
@@ -250,9 +252,10 @@ For extracting a 3-5 minute video from a longer one based on video understanding
                 logger.error("Error: {}, return code {}".format(e.output.decode('utf-8'), e.returncode))
             """
             if segment['Type'] == 'SHOT':
+                # full HH:MM:SS:FF timecodes for reference; event.py cuts at the millisecond timestamps
                 segment_info = {
-                    'startTimecodeSMPTE': segment['StartTimecodeSMPTE'].rsplit(':', 1)[0],
-                    'durationSMPTE': segment['DurationSMPTE'].rsplit(':', 1)[0],
+                    'startTimecodeSMPTE': segment['StartTimecodeSMPTE'],
+                    'durationSMPTE': segment['DurationSMPTE'],
                     'startTimestampMillis': segment['StartTimestampMillis'],
                     'endTimestampMillis': segment['EndTimestampMillis'],
                     'durationMillis': segment['DurationMillis']
@@ -270,44 +273,118 @@ For extracting a 3-5 minute video from a longer one based on video understanding
             # ffmpeg -f concat -safe 0 -i segments.txt -c copy output.mp4
             # ffmpeg -i segments.txt -c copy output.mp4
 
-        # RANDOM_VIDEO_FILE = str(uuid.uuid1()) + '-sliced-output.mp4'
-        # REMOTE_SLICED_VIDEO_FILE = s3Object.split('.')[0] + '/' + RANDOM_VIDEO_FILE
-        # slicedFilelist.append(REMOTE_SLICED_VIDEO_FILE)
-        # logger.info('slicedFilelist is as follows {}'.format(slicedFilelist))
-
-        detail = {
-            'jobId': jobId,
-            # iframe video path
-            's3Object': s3Object,
-            's3Bucket': s3Bucket,
-            'segmentsMeta': segments_meta
-        }
-
-        eventEntries = {
-            'Time': time.time(),
-            'Source': 'custom',
-            'EventBusName': os.environ.get('EVENT_BUS_NAME'),
-            'DetailType': 'videoShotsAndGif',
-            'Detail': json.dumps(detail)
-        }
-        logger.info('eventEntries: {}'.format(json.dumps(eventEntries)))
+    # RANDOM_VIDEO_FILE = str(uuid.uuid1()) + '-sliced-output.mp4'
+    # REMOTE_SLICED_VIDEO_FILE = s3Object.split('.')[0] + '/' + RANDOM_VIDEO_FILE
+    # slicedFilelist.append(REMOTE_SLICED_VIDEO_FILE)
+    # logger.info('slicedFilelist is as follows {}'.format(slicedFilelist))
+
+    detail = {
+        'jobId': jobId,
+        # iframe video path
+        's3Object': s3Object,
+        's3Bucket': s3Bucket
+    }
+    # one event for the whole video, split only if it exceeds the EventBridge entry size limit
+    chunks = chunk_segments(detail, segments_meta)
+    if CLAIM_CHECK == 'always' or (CLAIM_CHECK == 'auto' and len(chunks) > 1):
+        # claim check: the segments go to S3 and the event only carries a pointer to them
+        chunks = [dict(detail, segmentsRef=save_segments(jobId, s3Object, s3Bucket, segments_meta), chunk={
+            'index': 0,
+            'count': 1,
+            'offset': 0,
+            'total': len(segments_meta)
+        })]
+    logger.info('Publishing {} SHOT segments in {} event(s)'.format(len(segments_meta), len(chunks)))
+    for chunk in chunks:
+        put_event(chunk, maxRetry, retryInterval)
+
+def save_segments(jobId, s3Object, s3Bucket, segments_meta):
+    """
+    Write the segments to S3 in the columnar format of segments.py
+    :param jobId:          Segment detection job id
+    :param s3Object:       I-Frames video key, the file goes next to its sliced videos
+    :param s3Bucket:       Processed bucket
+    :param segments_meta:  All SHOT segments of the video, in order
+    :return:               Pointer for the event detail: bucket, key, size and segment count
+    """
+    data = pack_segments(segments_meta)
+    key = s3Object.split('.')[0] + '/' + jobId + '.segments'
+    s3.put_object(Bucket=s3Bucket, Key=key, Body=data)
+    logger.info("Saved {} segments ({} bytes) to s3://{}/{}".format(len(segments_meta), len(data), s3Bucket, key))
+    return {'bucket': s3Bucket, 'key': key, 'size': len(data), 'count': len(segments_meta)}
 
-        # put events to eventbridge
-        event.put_events(Entries=[eventEntries])
+def chunk_segments(detail, segments_meta):
+    """
+    Split the segments into event details that each fit in one EventBridge entry
+    :param detail:         Detail fields shared by every chunk
+    :param segments_meta:  All SHOT segments of the video, in order
+    :return:               List of details, each with a 'chunk' manifest of index, count, offset and total
+    """
+    # size of everything but the segments, with room for the manifest
+    manifest = {'index': 0, 'count': 0, 'offset': 0, 'total': len(segments_meta)}
+    base_size = entry_size(dict(detail, segmentsMeta=[], chunk=manifest)) + 64
+    chunks = [[]]
+    size = base_size
+    for segment in segments_meta:
+        # +2 for the ', ' json.dumps puts between list items
+        segment_size = len(json.dumps(segment).encode('utf-8')) + 2
+        if chunks[-1] and size + segment_size > MAX_EVENT_SIZE:
+            chunks.append([])
+            size = base_size
+        chunks[-1].append(segment)
+        size += segment_size
+
+    details = []
+    offset = 0
+    for index, chunk in enumerate(chunks):
+        details.append(dict(detail, segmentsMeta=chunk, chunk={
+            'index': index,
+            'count': len(chunks),
+            'offset': offset,
+            'total': len(segments_meta)
+        }))
+        offset += len(chunk)
+    return details
+
+def entry_size(detail):
+    """
+    Size EventBridge accounts for an entry with this detail
+    """
+    # Time is counted as 14 bytes, strings as their UTF-8 length
+    return 14 + len(EVENT_SOURCE) + len(EVENT_DETAIL_TYPE) + len(json.dumps(detail).encode('utf-8'))
 
-        attemptCount = 0
-        MAX_ATTEMPT = 3
-        while (attemptCount < int(MAX_ATTEMPT)):
+def put_event(detail, maxRetry=3, retryInterval=5):
+    """
+    Put one event to EventBridge, retrying failed entries
+    :param detail:         Event detail
+    :param maxRetry:       Attempts before giving up
+    :param retryInterval:  Seconds between attempts
+    :return:               True if the event was accepted
+    """
+    eventEntries = {
+        'Time': time.time(),
+        'Source': EVENT_SOURCE,
+        'EventBusName': os.environ.get('EVENT_BUS_NAME'),
+        'DetailType': EVENT_DETAIL_TYPE,
+        'Detail': json.dumps(detail)
+    }
+    logger.info('eventEntries: {} bytes, chunk {}'.format(len(eventEntries['Detail']), detail['chunk']))
+
+    for attemptCount in range(maxRetry):
+        # check ErrorCode or ErrorMessage for possible failure and retry
+        try:
             ret = event.put_events(Entries=[eventEntries])
-            # check ErrorCode or ErrorMessage for possible failure and retry
-            try:
-                if ret['FailedEntryCount'] == 0:
-                    logger.info('put events result as follows\n %s' % json.dumps(ret, indent=4))
-                    break
-            except:
-                logger.info('put events failed, retry after %s seconds' % retryInterval)
-                time.sleep(retryInterval)
-            attemptCount += 1
+            if ret['FailedEntryCount'] == 0:
+                logger.info('put events result as follows\n %s' % json.dumps(ret, indent=4))
+                return True
+            logger.error('put events failed: {}'.format(ret['Entries']))
+        except ClientError as e:
+            logger.error('put events failed: {}'.format(e))
+        if attemptCount + 1 < maxRetry:
+            logger.info('retry after %s seconds' % retryInterval)
+            time.sleep(retryInterval)
+    logger.error('Giving up on event after {} attempts'.format(maxRetry))
+    return False
 
 def upload_file(file_name, bucket, object_name=None):
     """Upload a file to an S3 bucket
@@ -0,0 +1,70 @@
+"""
+Cold start benchmark for the metadata Lambdas.
+
+Imports each handler module in a fresh interpreter, the way a new Lambda
+container does, and reports the time spent importing it and the time to create
+the AWS clients an invocation uses on first access. No AWS calls are made;
+creating a client only loads its service model.
+
+    python startup_benchmark.py
+    python startup_benchmark.py --runs 10 --handlers meta processor
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+HANDLERS = {
+    # handler module -> (clients, tables) its invocations touch
+    'meta': (['s3', 'rekognition', 'sqs'], ['metaData', 'videoFingerprints']),
+    'processor': (['s3', 'rekognition', 'sqs', 'events'], []),
+    'event': (['s3'], ['benchmark-table']),
+}
+
+# Run in the child interpreter, from the handler's directory
+CHILD = """
+import sys, json, time
+started = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+modules = sorted(m for m in ('numpy', 'PIL', 'boto3') if m in sys.modules)
+from clients import get_client, get_table
+for name in {clients!r}:
+    get_client(name)
+for name in {tables!r}:
+    get_table(name)
+initialized = time.perf_counter()
+print(json.dumps({{'import_ms': (imported - started) * 1000, 'clients_ms': (initialized - imported) * 1000, 'loaded': modules}}))
+"""
+
+def run_once(handler, clients, tables):
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), handler)
+    env = dict(os.environ)
+    # the handlers read these at import time
+    env.setdefault('LAMBDA_TASK_ROOT', directory)
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    env.setdefault('DYNAMODB_TABLE', 'benchmark-table')
+    code = CHILD.format(module=handler, clients=clients, tables=tables)
+    output = subprocess.run([sys.executable, '-c', code], cwd=directory, env=env,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import and client creation time of the metadata Lambda handlers")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per handler, the median is reported")
+    parser.add_argument("--handlers", nargs='+', choices=sorted(HANDLERS), default=sorted(HANDLERS))
+    args = parser.parse_args()
+
+    print("{:<10} {:>10} {:>11} {:>9}  {}".format('handler', 'import ms', 'clients ms', 'total ms', 'heavy modules loaded by import'))
+    for handler in args.handlers:
+        clients, tables = HANDLERS[handler]
+        results = [run_once(handler, clients, tables) for _ in range(args.runs)]
+        import_ms = statistics.median(result['import_ms'] for result in results)
+        clients_ms = statistics.median(result['clients_ms'] for result in results)
+        print("{:<10} {:>10.1f} {:>11.1f} {:>9.1f}  {}".format(handler, import_ms, clients_ms, import_ms + clients_ms,
+                                                           ', '.join(results[0]['loaded'])))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+import os
+import sys
+
+# the handlers read these at import time; AWS clients are only created on first use, so no AWS call is made
+os.environ.setdefault('LAMBDA_TASK_ROOT', '/tmp')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('DYNAMODB_TABLE', 'metaData')
+
+METADATA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# each handler imports its modules as top-level modules, as in its Lambda image; the shared ones are identical copies
+for handler in ('processor', 'event'):
+    sys.path.insert(0, os.path.join(METADATA_DIR, handler))
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+import processor
+from segments import pack_segments, unpack_segments
+
+def make_segments(count, length=1000):
+    return [{
+        'startTimecodeSMPTE': '00:00:00:00',
+        'durationSMPTE': '00:00:01:00',
+        'startTimestampMillis': index * length,
+        'endTimestampMillis': (index + 1) * length,
+        'durationMillis': length
+    } for index in range(count)]
+
+DETAIL = {'jobId': 'j' * 64, 's3Object': 'video-iframe-output.mp4', 's3Bucket': 'processed'}
+
+def test_pack_unpack_round_trip():
+    segments_meta = make_segments(1000)
+    data = pack_segments(segments_meta)
+    assert len(data) == 10 + 12 * len(segments_meta)
+    # the SMPTE timecodes are not stored
+    assert unpack_segments(data) == [{column: segment[column] for column in ('startTimestampMillis', 'endTimestampMillis', 'durationMillis')}
+                                     for segment in segments_meta]
+
+def test_pack_unpack_empty():
+    assert unpack_segments(pack_segments([])) == []
+
+def test_unpack_rejects_other_formats():
+    data = pack_segments(make_segments(2))
+    with pytest.raises(ValueError):
+        unpack_segments(b'JSON' + data[4:])
+
+def test_chunk_segments_fits_one_event():
+    details = processor.chunk_segments(DETAIL, make_segments(10))
+    assert len(details) == 1
+    assert details[0]['chunk'] == {'index': 0, 'count': 1, 'offset': 0, 'total': 10}
+    assert details[0]['jobId'] == DETAIL['jobId']
+
+def test_chunk_segments_without_segments():
+    details = processor.chunk_segments(DETAIL, [])
+    assert [detail['segmentsMeta'] for detail in details] == [[]]
+    assert details[0]['chunk'] == {'index': 0, 'count': 1, 'offset': 0, 'total': 0}
+
+def test_chunk_segments_splits_at_the_event_size_limit():
+    segments_meta = make_segments(5000)
+    details = processor.chunk_segments(DETAIL, segments_meta)
+    assert len(details) > 1
+    offset = 0
+    for index, detail in enumerate(details):
+        assert processor.entry_size(detail) <= processor.MAX_EVENT_SIZE
+        assert detail['chunk'] == {'index': index, 'count': len(details), 'offset': offset, 'total': len(segments_meta)}
+        offset += len(detail['segmentsMeta'])
+    # every segment exactly once and in order
+    assert [segment for detail in details for segment in detail['segmentsMeta']] == segments_meta
+    # chunks are filled up before the next one starts
+    next_segment = len(json.dumps(segments_meta[0]).encode('utf-8')) + 2
+    assert all(processor.entry_size(detail) + next_segment > processor.MAX_EVENT_SIZE - 64 for detail in details[:-1])
@@ -0,0 +1,28 @@
+"""
+Each Lambda image is built from its own directory, so the modules the handlers share are copied between them.
+"""
+import os
+import filecmp
+
+import pytest
+
+METADATA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HANDLERS = ('meta', 'processor', 'event')
+# shared module -> handler directories holding a copy of it
+SHARED_MODULES = {
+    'clients.py': ('meta', 'processor', 'event'),
+    'scratch.py': ('meta', 'event'),
+    'segments.py': ('processor', 'event'),
+}
+
+@pytest.mark.parametrize('module, handlers', sorted(SHARED_MODULES.items()))
+def test_copies_are_identical(module, handlers):
+    first = os.path.join(METADATA_DIR, handlers[0], module)
+    for handler in handlers[1:]:
+        copy = os.path.join(METADATA_DIR, handler, module)
+        assert filecmp.cmp(first, copy, shallow=False), "{}/{} differs from {}/{}".format(handler, module, handlers[0], module)
+
+@pytest.mark.parametrize('module, handlers', sorted(SHARED_MODULES.items()))
+def test_no_other_copies(module, handlers):
+    present = tuple(handler for handler in HANDLERS if os.path.exists(os.path.join(METADATA_DIR, handler, module)))
+    assert present == handlers
@@ -0,0 +1,113 @@
+import re
+
+import pytest
+from botocore.exceptions import ClientError
+
+import event
+
+class FakeTable:
+    """
+    In-memory stand-in for the DynamoDB table, evaluating the expressions save_sliced_lists and copy_to_duplicates use
+    """
+    CONDITIONS = {
+        "#segmentsJobId = :jobId AND NOT contains(#appliedChunks, :chunk)":
+            lambda item, values: item.get('segmentsJobId') == values[':jobId'] and values[':chunk'] not in item.get('appliedChunks', set()),
+        "attribute_not_exists(#segmentsJobId) OR #segmentsJobId <> :jobId":
+            lambda item, values: item.get('segmentsJobId') != values[':jobId'],
+    }
+
+    def __init__(self, items=None):
+        self.items = items or {}
+        self.updates = 0
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, ExpressionAttributeNames=None,
+                    ConditionExpression=None, ReturnValues=None):
+        self.updates += 1
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues
+        item = dict(self.items.get(Key['id'], Key))
+        if ConditionExpression and not self.CONDITIONS[ConditionExpression](item, values):
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'UpdateItem')
+
+        resolve = lambda name: names.get(name, name)
+        set_clause, _, add_clause = UpdateExpression[len('set '):].partition(' add ')
+        for name, value in re.findall(r'(#?\w+) = list_append\(#?\w+, (:\w+)\)', set_clause):
+            item[resolve(name)] = item[resolve(name)] + values[value]
+        for name, value in re.findall(r'(#?\w+) = (:\w+)', set_clause):
+            item[resolve(name)] = values[value]
+        for name, value in re.findall(r'(#?\w+) (:\w+)', add_clause):
+            item[resolve(name)] = item.get(resolve(name), set()) | values[value]
+        self.items[Key['id']] = item
+        return {'Attributes': dict(item)}
+
+@pytest.fixture
+def table(monkeypatch):
+    table = FakeTable({'video.mp4': {'id': 'video.mp4'}})
+    monkeypatch.setattr(event, 'table', table)
+    return table
+
+def save(job_id, index, count, videos):
+    return event.save_sliced_lists('video.mp4', job_id, {'index': index, 'count': count}, 'processed',
+                                   videos, [video.replace('.mp4', '.gif') for video in videos])
+
+def test_first_chunk_sets_the_lists(table):
+    assert save('job', 0, 1, ['a.mp4', 'b.mp4'])
+    item = table.items['video.mp4']
+    assert item['slicedVideos'] == ['a.mp4', 'b.mp4']
+    assert item['slicedGifs'] == ['a.gif', 'b.gif']
+    assert item['segmentsJobId'] == 'job'
+    assert item['appliedChunks'] == {'0'}
+
+def test_redelivered_chunk_is_applied_once(table):
+    assert save('job', 0, 2, ['a.mp4'])
+    assert save('job', 1, 2, ['b.mp4'])
+    assert not save('job', 1, 2, ['b.mp4'])
+    assert not save('job', 0, 2, ['a.mp4'])
+    item = table.items['video.mp4']
+    assert item['slicedVideos'] == ['a.mp4', 'b.mp4']
+    assert item['appliedChunks'] == {'0', '1'}
+
+def test_later_chunk_arriving_first(table):
+    assert save('job', 1, 2, ['b.mp4'])
+    assert save('job', 0, 2, ['a.mp4'])
+    item = table.items['video.mp4']
+    # lists are in arrival order, but hold every chunk exactly once
+    assert sorted(item['slicedVideos']) == ['a.mp4', 'b.mp4']
+    assert sorted(item['slicedGifs']) == ['a.gif', 'b.gif']
+    assert item['appliedChunks'] == {'0', '1'}
+    assert item['chunkCount'] == 2
+
+def test_new_job_replaces_the_old_lists(table):
+    assert save('old', 0, 2, ['a.mp4'])
+    assert save('old', 1, 2, ['b.mp4'])
+    assert save('new', 0, 1, ['c.mp4'])
+    item = table.items['video.mp4']
+    assert item['slicedVideos'] == ['c.mp4']
+    assert item['segmentsJobId'] == 'new'
+    assert item['appliedChunks'] == {'0'}
+    assert item['chunkCount'] == 1
+
+def test_chunk_started_by_a_concurrent_event(table, monkeypatch):
+    # another chunk of the job lands between the failed append and the replace, so the replace fails too
+    update_item = table.update_item
+
+    def racing_update_item(**kwargs):
+        if table.updates == 1:
+            table.items['video.mp4'] = {'id': 'video.mp4', 'slicedVideos': ['b.mp4'], 'slicedGifs': ['b.gif'],
+                                        'segmentsJobId': 'job', 'chunkCount': 2, 'appliedChunks': {'1'}}
+        return update_item(**kwargs)
+
+    monkeypatch.setattr(table, 'update_item', racing_update_item)
+    assert save('job', 0, 2, ['a.mp4'])
+    item = table.items['video.mp4']
+    assert item['slicedVideos'] == ['b.mp4', 'a.mp4']
+    assert item['appliedChunks'] == {'0', '1'}
+
+def test_lists_are_copied_to_duplicates(table):
+    table.items['video.mp4']['duplicates'] = {'copy.mp4'}
+    assert save('job', 0, 2, ['a.mp4'])
+    assert save('job', 1, 2, ['b.mp4'])
+    duplicate = table.items['copy.mp4']
+    assert duplicate['slicedVideos'] == ['a.mp4', 'b.mp4']
+    assert duplicate['slicedGifs'] == ['a.gif', 'b.gif']
+    assert duplicate['appliedChunks'] == {'0', '1'}
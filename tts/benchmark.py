@@ -0,0 +1,167 @@
+"""
+Throughput benchmark for tts.py that runs entirely offline.
+
+Generates synthetic subtitle files, runs them through the same parser,
+scheduler and timeline assembly as tts.py with FakePollyClient in place of
+Polly, and reports cues/sec, peak RSS and per-stage timings. mp3 encoding is
+left out so the numbers track our own code paths.
+
+Both assembly modes are measured: 'default' grows the whole track in memory
+and builds the final AudioSegment as tts.py does before export, 'stream'
+drains finished audio as --stream does.
+
+    python benchmark.py                      # 100, 10k and 100k cues, both modes up to 10k
+    python benchmark.py --sizes 1000 --modes default --latency 0.05 --throttle-rate 0.02
+
+Each size and mode runs in a fresh interpreter so peak RSS is measured per case.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import tempfile
+import subprocess
+
+DEFAULT_SIZES = (100, 10000, 100000)
+MODES = ('default', 'stream')
+# 'default' holds the whole track, about 70 KB per synthetic cue, so larger sizes are streamed unless --modes asks for it
+DEFAULT_MODE_MAX_CUES = 10000
+# Synthetic cue layout: short lines with gaps, like dialogue-heavy captions
+CUE_MS = 1800
+GAP_MS = 400
+WORDS = ('yes', 'no', 'maybe', 'the', 'quick', 'brown', 'fox', 'jumps', 'over', 'lazy', 'dog', 'again', 'today', 'later')
+
+def format_timestamp(ms):
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+def write_synthetic_srt(path, cue_count, unique=True):
+    """Write an SRT file of cue_count cues; unique=False repeats a small set of lines."""
+    with open(path, 'w', encoding='utf-8') as file:
+        for i in range(cue_count):
+            start = i * (CUE_MS + GAP_MS)
+            words = [WORDS[(i * 7 + k * 3) % len(WORDS)] for k in range(3 + i % 5)]
+            text = ' '.join(words) + (f" {i}" if unique else '')
+            file.write(f"{i + 1}\n{format_timestamp(start)} --> {format_timestamp(start + CUE_MS)}\n{text}\n\n")
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def run_case(cue_count, workers, latency, throttle_rate, merge_ms, unique, stream):
+    import tts
+    from fake_polly import FakePollyClient
+
+    class NullSink:
+        def write(self, samples):
+            pass
+
+        def close(self):
+            pass
+
+    class BenchmarkJob(tts.SubtitleJob):
+        """Assembles the track like SubtitleJob without encoding it, timing each accept and the finish."""
+
+        def __init__(self, subtitle_file, merge_ms):
+            super().__init__(subtitle_file, os.devnull, stream=False, merge_ms=merge_ms)
+            if stream:
+                # Drain into a sink that drops the audio instead of an ffmpeg encoder
+                self.stream = True
+                self.encoder = NullSink()
+            self.assembly_seconds = 0.0
+
+        def accept(self, subtitle, rendered):
+            started = time.perf_counter()
+            super().accept(subtitle, rendered)
+            self.assembly_seconds += time.perf_counter() - started
+
+        def finish(self):
+            started = time.perf_counter()
+            if self.stream:
+                self.encoder.write(self.timeline.drain())
+            else:
+                # The whole track as exported, minus the mp3 encoding
+                self.timeline.to_audio_segment()
+            self.assembly_seconds += time.perf_counter() - started
+            self.finished = True
+
+        def abort(self):
+            pass
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, f"synthetic-{cue_count}.srt")
+        write_synthetic_srt(path, cue_count, unique)
+
+        started = time.perf_counter()
+        parsed = sum(1 for _ in tts.parse_srt(path))
+        parse_seconds = time.perf_counter() - started
+
+        client = FakePollyClient(latency=latency, throttle_rate=throttle_rate)
+        tts.THROTTLE_BASE_DELAY = min(tts.THROTTLE_BASE_DELAY, 0.01)
+        job = BenchmarkJob(path, merge_ms)
+        started = time.perf_counter()
+        tts.run_jobs(client, [job], 'Ruth', workers, cache=None, fit=True)
+        run_seconds = time.perf_counter() - started
+
+    return {
+        'cues': parsed,
+        'mode': 'stream' if stream else 'default',
+        'parse_s': parse_seconds,
+        'synthesis_s': run_seconds - job.assembly_seconds,
+        'assembly_s': job.assembly_seconds,
+        'total_s': parse_seconds + run_seconds,
+        'cues_per_s': parsed / run_seconds if run_seconds else float('inf'),
+        'polly_calls': client.calls,
+        'throttled': client.throttled,
+        'fitted': len(job.fitted),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tts.py parsing, synthesis scheduling and timeline assembly offline")
+    parser.add_argument("--sizes", type=int, nargs='+', default=list(DEFAULT_SIZES), help="Cue counts to benchmark")
+    parser.add_argument("--workers", type=int, default=8, help="Worker threads, as tts.py --workers")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per fake Polly call")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of fake Polly calls that are throttled")
+    parser.add_argument("--merge-short-cues", type=int, default=0, metavar="MS", help="As tts.py --merge-short-cues")
+    parser.add_argument("--modes", nargs='+', choices=MODES, help=f"Assembly modes to benchmark (default: both, stream only above {DEFAULT_MODE_MAX_CUES} cues)")
+    parser.add_argument("--repeated", action="store_true", help="Use a small set of repeated lines instead of unique cue text")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON lines")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--stream", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        # Child process: run one case and hand the result back on stdout
+        sys.stdout.write(json.dumps(run_case(args.single, args.workers, args.latency, args.throttle_rate, args.merge_short_cues, not args.repeated, args.stream)))
+        return
+
+    if not args.json:
+        print(f"{'cues':>8} {'mode':>8} {'parse s':>9} {'synth s':>9} {'assembly s':>11} {'total s':>9} {'cues/s':>10} {'calls':>8} {'peak MB':>8}")
+    for size in args.sizes:
+        modes = args.modes or [mode for mode in MODES if mode == 'stream' or size <= DEFAULT_MODE_MAX_CUES]
+        for mode in modes:
+            command = [sys.executable, os.path.abspath(__file__), '--single', str(size),
+                       '--workers', str(args.workers), '--latency', str(args.latency),
+                       '--throttle-rate', str(args.throttle_rate), '--merge-short-cues', str(args.merge_short_cues)]
+            if args.repeated:
+                command.append('--repeated')
+            if mode == 'stream':
+                command.append('--stream')
+            try:
+                output = subprocess.run(command, check=True, capture_output=True, text=True,
+                                        cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+            except subprocess.CalledProcessError as e:
+                sys.stderr.write(e.stderr)
+                sys.exit(f"{size} cues in {mode} mode failed with exit code {e.returncode}")
+            result = json.loads(output)
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print(f"{result['cues']:>8} {result['mode']:>8} {result['parse_s']:>9.3f} {result['synthesis_s']:>9.3f} {result['assembly_s']:>11.3f} "
+                      f"{result['total_s']:>9.3f} {result['cues_per_s']:>10.0f} {result['polly_calls']:>8} {result['peak_rss_mb']:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import io
+import re
+import json
+import time
+import random
+import zlib
+import threading
+import numpy as np
+from botocore.exceptions import ClientError
+
+# Rough speaking rate of the fake voice
+MS_PER_CHAR = 60
+MARK_PATTERN = re.compile(r'<mark name="([^"]*)"/>')
+TAG_PATTERN = re.compile(r'<[^>]+>')
+RATE_PATTERN = re.compile(r'<prosody rate="(\d+)%">')
+
+class FakePollyClient:
+    """
+    Offline stand-in for the boto3 Polly client.
+
+    Implements the subset of synthesize_speech used by tts.py: PCM audio is a
+    tone whose pitch is derived from the text and whose length grows with it,
+    prosody rates shorten it, and SSML speech mark requests return mark offsets
+    consistent with the audio. Output only depends on the request, so runs are
+    repeatable. Latency and throttling can be injected to exercise scheduling.
+
+    :param latency:        Seconds each call takes
+    :param throttle_rate:  Fraction of calls failing with ThrottlingException
+    :param seed:           Seed for the throttling decisions
+    """
+
+    def __init__(self, latency=0.0, throttle_rate=0.0, seed=0):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.calls = 0
+        self.throttled = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def synthesize_speech(self, Text, VoiceId, OutputFormat, Engine=None, TextType='text', SampleRate='16000', SpeechMarkTypes=None):
+        with self._lock:
+            self.calls += 1
+            throttle = self._random.random() < self.throttle_rate
+            if throttle:
+                self.throttled += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if throttle:
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'SynthesizeSpeech')
+
+        rate = 100
+        pieces = [('', Text)]
+        if TextType == 'ssml':
+            match = RATE_PATTERN.search(Text)
+            if match:
+                rate = int(match.group(1))
+            # Split on marks: [(mark name, text spoken after it), ...]
+            parts = MARK_PATTERN.split(Text)
+            pieces = [('', parts[0])] + list(zip(parts[1::2], parts[2::2]))
+            pieces = [(name, TAG_PATTERN.sub('', text)) for name, text in pieces]
+
+        if OutputFormat == 'json':
+            lines = []
+            offset = 0
+            for name, text in pieces:
+                if name:
+                    lines.append(json.dumps({'time': offset, 'type': 'ssml', 'start': 0, 'end': 0, 'value': name}))
+                offset += len(text.strip()) * MS_PER_CHAR * 100 // rate
+            return {'AudioStream': io.BytesIO('\n'.join(lines).encode('utf-8'))}
+
+        frame_rate = int(SampleRate)
+        spoken = ''.join(text for _, text in pieces).strip()
+        duration_ms = len(spoken) * MS_PER_CHAR * 100 // rate
+        frequency = 150 + zlib.crc32(spoken.encode('utf-8')) % 150
+        t = np.arange(frame_rate * duration_ms // 1000) / frame_rate
+        samples = (np.sin(2 * np.pi * frequency * t) * 8000).astype('<i2')
+        return {'AudioStream': io.BytesIO(samples.tobytes())}
@@ -0,0 +1,119 @@
+import os
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')), 'kada-tts')
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+CACHE_SUFFIX = '.seg'
+
+def normalize_text(text):
+    # Whitespace differences never change what Polly says
+    return ' '.join(text.split())
+
+class SegmentCache:
+    """
+    Content-addressed on-disk cache of synthesized speech segments.
+
+    Entries are keyed by a hash of (normalized text, voice id, engine, output
+    format) and stored one file per segment. The total size is capped and the
+    least recently used entries are evicted first; the file mtime records the
+    last access so recency survives across runs.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        # key -> [size, last access], rebuilt from disk on startup
+        self._index = {}
+        self._total_bytes = 0
+        for name in os.listdir(cache_dir):
+            if not name.endswith(CACHE_SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                continue
+            self._index[name[:-len(CACHE_SUFFIX)]] = [stat.st_size, stat.st_mtime]
+            self._total_bytes += stat.st_size
+        logger.debug(f"Segment cache {cache_dir}: {len(self._index)} entries, {self._total_bytes} bytes")
+
+    @staticmethod
+    def make_key(text, voice_id, engine, output_format):
+        material = '\x1f'.join((normalize_text(text), voice_id, engine, output_format))
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_SUFFIX)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+                entry = self._index.pop(key, None)
+                if entry:
+                    self._total_bytes -= entry[0]
+            return None
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if key in self._index:
+                self._index[key][1] = now
+            else:
+                self._index[key] = [len(data), now]
+                self._total_bytes += len(data)
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        # Write to a temp file and rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as error:
+            logger.warning(f"Could not write cache entry {key}: {error}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            previous = self._index.get(key)
+            if previous:
+                self._total_bytes -= previous[0]
+            self._index[key] = [len(data), time.time()]
+            self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Called with the lock held; drop oldest entries until comfortably under
+        # the cap so we do not re-sort the index on every subsequent put
+        low_water = self.max_bytes * 0.9
+        for key, (size, _) in sorted(self._index.items(), key=lambda item: item[1][1]):
+            if self._total_bytes <= low_water:
+                break
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            del self._index[key]
+            self._total_bytes -= size
+            logger.debug(f"Evicted cache entry {key} ({size} bytes)")
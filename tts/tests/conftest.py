@@ -0,0 +1,5 @@
+import os
+import sys
+
+# tts.py imports its modules as top-level modules, as when run from its directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
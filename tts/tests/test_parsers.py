@@ -0,0 +1,51 @@
+import tts
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+def test_srt_crlf_bom_and_unterminated_final_cue(tmp_path):
+    path = write(tmp_path, 'crlf.srt', b'\xef\xbb\xbf1\r\n00:00:01,000 --> 00:00:02,000\r\nHello\r\n\r\n'
+                                       b'2\r\n00:00:03,000 --> 00:00:04,500\r\nWorld\r\nsecond line')
+    assert list(tts.parse_srt(path)) == [
+        ('1', '00:00:01,000', '00:00:02,000', 'Hello'),
+        ('2', '00:00:03,000', '00:00:04,500', 'World\nsecond line'),
+    ]
+
+def test_srt_skips_malformed_blocks(tmp_path):
+    path = write(tmp_path, 'malformed.srt', b'1\n00:00:01,000 --> 00:00:02,000\n42\n\n'
+                                            b'2\nnot a timing line\nDropped\n\n'
+                                            b'3\n00:00:05,000 --> 00:00:06,000\n\n\n'
+                                            b'4\n00:00:07,000 --> 00:00:08,000\nKept\n')
+    # text that looks like an index is still text, blocks without timing or text are dropped
+    assert list(tts.parse_srt(path)) == [
+        ('1', '00:00:01,000', '00:00:02,000', '42'),
+        ('4', '00:00:07,000', '00:00:08,000', 'Kept'),
+    ]
+
+def test_srt_is_streamed(tmp_path):
+    path = write(tmp_path, 'stream.srt', b'1\n00:00:01,000 --> 00:00:02,000\nHello\n')
+    cues = tts.parse_srt(path)
+    assert not isinstance(cues, list)
+    assert next(cues) == ('1', '00:00:01,000', '00:00:02,000', 'Hello')
+
+def test_vtt_header_notes_ids_and_markup(tmp_path):
+    path = write(tmp_path, 'cues.vtt', b'\xef\xbb\xbfWEBVTT - title\r\n\r\n'
+                                       b'NOTE a comment\r\nover two lines\r\n\r\n'
+                                       b'STYLE\r\n::cue { color: yellow }\r\n\r\n'
+                                       b'00:01.000 --> 00:02.000 align:start position:10%\r\n<v Bob>Hi &amp; bye</v>\r\n\r\n'
+                                       b'intro\r\n01:00:03.5 --> 01:00:04.000\r\n<i>Last</i> <00:00:03.700>line')
+    assert list(tts.parse_vtt(path)) == [
+        ('1', '00:00:01,000', '00:00:02,000', 'Hi & bye'),
+        ('intro', '01:00:03,500', '01:00:04,000', 'Last line'),
+    ]
+
+def test_vtt_drops_cues_without_text(tmp_path):
+    path = write(tmp_path, 'empty.vtt', b'WEBVTT\n\n00:01.000 --> 00:02.000\n<c.silent></c>\n\n00:03.000 --> 00:04.000\nSpoken\n')
+    assert list(tts.parse_vtt(path)) == [('2', '00:00:03,000', '00:00:04,000', 'Spoken')]
+
+def test_scan_end_ms_matches_the_parsed_cues(tmp_path):
+    path = write(tmp_path, 'unordered.srt', b'1\r\n00:00:01,000 --> 00:01:02,250\r\nLong\r\n\r\n'
+                                            b'2\r\n00:00:03,000 --> 00:00:04,000\r\nShort')
+    assert tts.scan_end_ms(path) == max(tts.time_to_ms(end) for _, _, end, _ in tts.parse_srt(path)) == 62250
@@ -0,0 +1,160 @@
+import sys
+import logging
+import subprocess
+import numpy as np
+from pydub import AudioSegment
+from pydub.utils import get_encoder_name
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_DTYPE = np.dtype('<i2')
+
+class Timeline:
+    """
+    Output track backed by a single preallocated sample buffer.
+
+    The buffer covers the whole program up front and starts out silent, so
+    placing a segment is a slice write at its start offset and assembly is
+    linear in the output length no matter how many cues there are.
+    Overlapping segments are mixed rather than shifted. When the duration is
+    not known in advance (streamed cues) the buffer doubles as needed, which
+    keeps assembly amortized linear.
+
+    In streaming mode finished audio is taken off the front with drain(), so
+    the buffer only holds the window between the last flush and the newest
+    cue. Sample positions are absolute; base_sample is the first one still held.
+    """
+
+    def __init__(self, duration_ms, frame_rate):
+        self.frame_rate = frame_rate
+        self.samples = np.zeros(self.ms_to_samples(duration_ms), dtype=SAMPLE_DTYPE)
+        self.base_sample = 0
+        # One past the last sample written, so trailing silence is not exported
+        self.end_sample = 0
+
+    def ms_to_samples(self, ms):
+        return ms * self.frame_rate // 1000
+
+    def __len__(self):
+        """Length of the audible track in milliseconds, like AudioSegment."""
+        return self.end_sample * 1000 // self.frame_rate
+
+    def _reserve(self, sample_count):
+        # sample_count is relative to base_sample
+        if sample_count <= len(self.samples):
+            return
+        grown = np.zeros(max(sample_count, 2 * len(self.samples)), dtype=SAMPLE_DTYPE)
+        live = max(0, self.end_sample - self.base_sample)
+        grown[:live] = self.samples[:live]
+        self.samples = grown
+
+    def place(self, start_ms, segment, max_duration_ms=None):
+        """
+        Write segment samples at start_ms.
+
+        :param start_ms:         Offset of the cue in the track
+        :param segment:          1-D int16 sample array
+        :param max_duration_ms:  Truncate the segment to this length if given
+        :return:                 Duration actually placed in milliseconds
+        """
+        start = self.ms_to_samples(start_ms)
+        count = len(segment)
+        if max_duration_ms is not None:
+            count = min(count, self.ms_to_samples(max_duration_ms))
+        if start < self.base_sample:
+            # Only happens for out-of-order cues once audio has been streamed out
+            skipped = self.base_sample - start
+            logger.warning(f"Cue at {start_ms}ms starts before already flushed audio, dropping its first {skipped * 1000 // self.frame_rate}ms")
+            segment = segment[skipped:]
+            count -= skipped
+            start = self.base_sample
+        if count <= 0:
+            return 0
+        offset = start - self.base_sample
+        self._reserve(offset + count)
+        region = self.samples[offset:offset + count]
+        if start < self.end_sample:
+            # Overlaps earlier speech, mix with saturation
+            mixed = region.astype(np.int32) + segment[:count]
+            np.clip(mixed, -32768, 32767, out=mixed)
+            region[:] = mixed
+        else:
+            region[:] = segment[:count]
+        self.end_sample = max(self.end_sample, start + count)
+        return count * 1000 // self.frame_rate
+
+    def pending_ms(self, until_ms):
+        """Milliseconds of audio a drain(until_ms) would release."""
+        return max(0, self.ms_to_samples(until_ms) - self.base_sample) * 1000 // self.frame_rate
+
+    def drain(self, until_ms=None):
+        """
+        Remove and return finished samples from the front of the buffer.
+
+        :param until_ms:  Release audio up to this position, silence included;
+                          None releases everything written so far
+        :return:          int16 sample array
+        """
+        target = self.end_sample if until_ms is None else self.ms_to_samples(until_ms)
+        count = target - self.base_sample
+        if count <= 0:
+            return np.zeros(0, dtype=SAMPLE_DTYPE)
+        self._reserve(count)
+        chunk = self.samples[:count].copy()
+        # Compact the live window into a fresh buffer so released audio is freed
+        live = max(0, self.end_sample - target)
+        remaining = np.zeros(max(live, len(self.samples) - count), dtype=SAMPLE_DTYPE)
+        remaining[:live] = self.samples[count:count + live]
+        self.samples = remaining
+        self.base_sample = target
+        self.end_sample = max(self.end_sample, target)
+        return chunk
+
+    def to_audio_segment(self):
+        # A byte view of the buffer rather than a copy of the whole track
+        return AudioSegment(
+            data=memoryview(self.samples[:self.end_sample - self.base_sample]).cast('B'),
+            sample_width=SAMPLE_DTYPE.itemsize,
+            frame_rate=self.frame_rate,
+            channels=1
+        )
+
+class StreamEncoder:
+    """
+    Incremental mp3 encoder fed with raw samples.
+
+    Runs one ffmpeg process (the same encoder pydub uses for export) reading
+    PCM from a pipe, so chunks are encoded and flushed to the output file, or
+    to stdout when output is '-', as soon as they are written.
+    """
+
+    def __init__(self, output, frame_rate):
+        self.output = output
+        command = [
+            get_encoder_name(), '-y', '-loglevel', 'error',
+            '-f', 's16le', '-ar', str(frame_rate), '-ac', '1', '-i', 'pipe:0',
+            '-f', 'mp3', 'pipe:1' if output == '-' else output
+        ]
+        stdout = sys.stdout.buffer if output == '-' else subprocess.DEVNULL
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=stdout)
+
+    def write(self, samples):
+        if len(samples):
+            self.process.stdin.write(samples.tobytes())
+            self.process.stdin.flush()
+
+    def close(self):
+        self.process.stdin.close()
+        returncode = self.process.wait()
+        if returncode != 0:
+            raise RuntimeError(f"Encoder exited with code {returncode} while writing {self.output}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.process.kill()
+            self.process.wait()
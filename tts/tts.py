@@ -1,26 +1,134 @@
 import boto3
 import os
 import re
+import glob
+import sys
+import html
+import time
+import json
+import random
 import logging
+import threading
 import argparse
+import csv
+from collections import deque, OrderedDict
+from xml.sax.saxutils import escape
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from botocore.config import Config
 from botocore.exceptions import BotoCoreError, ClientError
-from pydub import AudioSegment
+import numpy as np
 from tqdm import tqdm
+from segment_cache import SegmentCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES
+from timeline import Timeline, StreamEncoder, SAMPLE_DTYPE
+from stretch import time_stretch
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
+# Number of concurrent Polly requests when --workers is not given
+DEFAULT_WORKERS = 8
+# Subtitle files assembled side by side in batch mode
+DEFAULT_ACTIVE_FILES = 4
+# Retries for a single cue when Polly keeps throttling us
+MAX_THROTTLE_RETRIES = 6
+THROTTLE_BASE_DELAY = 0.5
+THROTTLE_ERROR_CODES = ('ThrottlingException', 'Throttling', 'TooManyRequestsException', 'ServiceQuotaExceededException')
+
+POLLY_ENGINE = 'generative'
+# Raw 16-bit mono PCM needs no decoding; 16 kHz is the highest rate Polly offers for pcm
+OUTPUT_FORMAT = 'pcm'
+SAMPLE_RATE = 16000
+# In streaming mode, hand finished audio to the encoder in chunks of at least this length
+STREAM_CHUNK_MS = 5000
+
+# Limits of the fit-to-slot stage: Polly accepts prosody rates down to 20%, but
+# past these ratios speech becomes unintelligible and we truncate the rest instead
+MAX_PROSODY_RATE = 200
+MAX_STRETCH_RATIO = 2.0
+
+# Audio of repeated cue text kept in memory for the rest of a run
+DEDUP_MEMORY_BYTES = 64 * 1024 * 1024
+# Bounds of a merged request when --merge-short-cues is used
+MERGE_MAX_GAP_MS = 1500
+MERGE_MAX_CUES = 8
+MERGE_MAX_CHARS = 1000
+
 def setup_logging(debug=False):
     log_level = logging.DEBUG if debug else logging.INFO
     logging.basicConfig(level=log_level, format='%(asctime)s - %(levelname)s - %(message)s')
     if not debug:
         logging.getLogger().handlers = []  # Remove all handlers
 
+TIMING_PATTERN = re.compile(r'^\s*((?:\d+:)?\d{1,2}:\d{2}[,.]\d{1,3})\s*-->\s*((?:\d+:)?\d{1,2}:\d{2}[,.]\d{1,3})')
+# Voice spans, classes, italics and inline timestamps in WebVTT cue text
+VTT_TAG_PATTERN = re.compile(r'<[^>]*>')
+
+def normalize_timestamp(timestamp):
+    """Convert SRT or WebVTT timestamps ('00:01.5', '1:02:03.450') to 'HH:MM:SS,mmm'."""
+    clock, ms = re.split(r'[,.]', timestamp)
+    parts = [int(part) for part in clock.split(':')]
+    if len(parts) == 2:
+        parts.insert(0, 0)
+    h, m, s = parts
+    return f"{h:02d}:{m:02d}:{s:02d},{ms.ljust(3, '0')}"
+
+def iter_blocks(file):
+    """Yield lists of non-blank lines separated by blank lines, including a final unterminated block."""
+    block = []
+    for line in file:
+        line = line.rstrip('\r\n')
+        if line.strip():
+            block.append(line)
+        elif block:
+            yield block
+            block = []
+    if block:
+        yield block
+
+def parse_cue_block(block, fallback_index):
+    """Turn one SRT/WebVTT block into an (index, start, end, text) cue, or None if it is not a cue."""
+    for position, line in enumerate(block):
+        match = TIMING_PATTERN.match(line)
+        if match:
+            break
+    else:
+        return None
+    index = block[position - 1].strip() if position > 0 else str(fallback_index)
+    text = '\n'.join(block[position + 1:])
+    if not text.strip():
+        return None
+    return (index, normalize_timestamp(match.group(1)), normalize_timestamp(match.group(2)), text)
+
 def parse_srt(file_path):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        content = file.read()
-    subtitle_pattern = re.compile(r'(\d+)\n(\d{2}:\d{2}:\d{2},\d{3}) --> (\d{2}:\d{2}:\d{2},\d{3})\n((?:.+(?:\n.+)*))\n\n', re.MULTILINE)
-    return subtitle_pattern.findall(content)
+    """
+    Stream cues from an SRT file, yielding (index, start, end, text) as they are read.
+
+    Handles CRLF line endings, a UTF-8 BOM and a last cue without a trailing
+    blank line.
+    """
+    # utf-8-sig strips the BOM, universal newlines fold CRLF into LF
+    with open(file_path, 'r', encoding='utf-8-sig') as file:
+        for count, block in enumerate(iter_blocks(file), start=1):
+            cue = parse_cue_block(block, count)
+            if cue:
+                yield cue
+            else:
+                logger.debug(f"Skipping malformed SRT block: {block}")
+
+def parse_vtt(file_path):
+    """Stream cues from a WebVTT file through the same interface as parse_srt."""
+    with open(file_path, 'r', encoding='utf-8-sig') as file:
+        count = 0
+        for block in iter_blocks(file):
+            # Header, NOTE, STYLE and REGION blocks carry no timing line and are dropped
+            cue = parse_cue_block(block, count + 1)
+            if not cue:
+                continue
+            count += 1
+            index, start, end, text = cue
+            text = html.unescape(VTT_TAG_PATTERN.sub('', text))
+            if text.strip():
+                yield (index, start, end, text)
 
 def parse_txt(file_path):
     with open(file_path, 'r', encoding='utf-8') as file:
@@ -33,79 +141,557 @@ def parse_txt(file_path):
         subtitles.append((str(i+1), start_time, end_time, line.strip()))
     return subtitles
 
+SUBTITLE_EXTENSIONS = ('.srt', '.vtt', '.txt')
+
+def read_subtitles(subtitle_file):
+    """Return the cues of a subtitle file, streamed for .srt/.vtt and as a list for .txt."""
+    extension = os.path.splitext(subtitle_file)[1].lower()
+    if extension == '.srt':
+        return parse_srt(subtitle_file)
+    if extension == '.vtt':
+        return parse_vtt(subtitle_file)
+    if extension == '.txt':
+        return parse_txt(subtitle_file)
+    raise ValueError("Unsupported file format. Please use .srt, .vtt or .txt files.")
+
 def time_to_ms(time_str):
     h, m, s = time_str.split(':')
     s, ms = s.split(',')
     return int(h) * 3600000 + int(m) * 60000 + int(s) * 1000 + int(ms)
 
-def synthesize_speech(polly_client, text, voice_id):
-    try:
-        response = polly_client.synthesize_speech(
-            Engine='generative',
-            Text=text.strip(),
-            OutputFormat='mp3',
-            VoiceId=voice_id
-        )
-        if "AudioStream" in response:
-            return response["AudioStream"].read()
-    except (BotoCoreError, ClientError) as error:
-        logger.error(f"Error synthesizing speech for text: {text}\nError: {error}")
-    return None
+def scan_end_ms(subtitle_file):
+    """
+    Latest cue end of an SRT/WebVTT file, from a pass over its timing lines only.
 
-def convert_text_to_speech(subtitle_file, voice_id, debug=False):
-    setup_logging(debug)
-    polly_client = boto3.client('polly')
+    Cheap next to synthesis, and lets the track of streamed cues be sized once
+    up front while the parser still feeds synthesis lazily.
+    """
+    end_ms = 0
+    with open(subtitle_file, 'r', encoding='utf-8-sig') as file:
+        for line in file:
+            match = TIMING_PATTERN.match(line)
+            if match:
+                end_ms = max(end_ms, time_to_ms(normalize_timestamp(match.group(2))))
+    return end_ms
+
+def create_polly_client(workers=DEFAULT_WORKERS):
+    # One client is shared by all worker threads, so the connection pool must be
+    # at least as large as the pool; adaptive retries rate-limit us client side
+    # once Polly starts throttling.
+    config = Config(
+        max_pool_connections=max(workers, 10),
+        retries={'max_attempts': 5, 'mode': 'adaptive'}
+    )
+    return boto3.client('polly', config=config)
+
+def synthesize_speech(polly_client, text, voice_id, text_type='text', speech_marks=False):
+    """
+    Call Polly for one request, backing off while throttled.
 
-    if subtitle_file.endswith('.srt'):
-        subtitles = parse_srt(subtitle_file)
-    elif subtitle_file.endswith('.txt'):
-        subtitles = parse_txt(subtitle_file)
+    :param speech_marks:  Request the SSML <mark> timings as JSON lines instead of audio
+    :return:              Raw PCM (or speech mark) bytes, None on failure
+    """
+    if speech_marks:
+        output = {'OutputFormat': 'json', 'SpeechMarkTypes': ['ssml']}
     else:
-        raise ValueError("Unsupported file format. Please use .srt or .txt files.")
+        output = {'OutputFormat': OUTPUT_FORMAT, 'SampleRate': str(SAMPLE_RATE)}
+    for attempt in range(MAX_THROTTLE_RETRIES + 1):
+        try:
+            response = polly_client.synthesize_speech(
+                Engine=POLLY_ENGINE,
+                Text=text.strip(),
+                TextType=text_type,
+                VoiceId=voice_id,
+                **output
+            )
+            if "AudioStream" in response:
+                return response["AudioStream"].read()
+            return None
+        except ClientError as error:
+            code = error.response.get('Error', {}).get('Code')
+            if code in THROTTLE_ERROR_CODES and attempt < MAX_THROTTLE_RETRIES:
+                # Exponential backoff with full jitter
+                delay = random.uniform(0, THROTTLE_BASE_DELAY * (2 ** attempt))
+                logger.debug(f"Throttled by Polly ({code}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            logger.error(f"Error synthesizing speech for text: {text}\nError: {error}")
+            return None
+        except BotoCoreError as error:
+            logger.error(f"Error synthesizing speech for text: {text}\nError: {error}")
+            return None
+    return None
+
+class SpeechMemo:
+    """
+    Run-scoped memo that makes repeated cue text cost one Polly request.
+
+    The first worker to ask for a key synthesizes it; workers asking for the same
+    key meanwhile wait for that result instead of issuing their own request.
+    Finished entries are kept up to max_bytes, least recently used first out.
+    """
+
+    def __init__(self, max_bytes=DEDUP_MEMORY_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get_or_synthesize(self, key, synthesize):
+        with self._lock:
+            entry = self._entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = self._entries[key] = Future()
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if not owner:
+            return entry.result()
+        try:
+            data = synthesize()
+        except BaseException as error:
+            with self._lock:
+                self._entries.pop(key, None)
+            entry.set_exception(error)
+            raise
+        entry.set_result(data)
+        with self._lock:
+            if not data:
+                # Let a later duplicate try again
+                self._entries.pop(key, None)
+                return data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and self._entries:
+                oldest_key = next(iter(self._entries))
+                oldest = self._entries[oldest_key]
+                if not oldest.done():
+                    break
+                del self._entries[oldest_key]
+                self._bytes -= len(oldest.result() or b'')
+        return data
+
+def synthesize_cached(polly_client, text, voice_id, cache=None, text_type='text', memo=None, speech_marks=False):
+    """Return audio for text, consulting the run memo and the segment cache before calling Polly."""
+    output_format = 'json/ssml-marks' if speech_marks else f"{OUTPUT_FORMAT}/{SAMPLE_RATE}"
+    key = SegmentCache.make_key(text, voice_id, POLLY_ENGINE, output_format)
+
+    def synthesize():
+        if cache is None:
+            return synthesize_speech(polly_client, text, voice_id, text_type, speech_marks)
+        audio_data = cache.get(key)
+        if audio_data is not None:
+            return audio_data
+        audio_data = synthesize_speech(polly_client, text, voice_id, text_type, speech_marks)
+        if audio_data:
+            cache.put(key, audio_data)
+        return audio_data
+
+    if memo is None:
+        return synthesize()
+    return memo.get_or_synthesize(key, synthesize)
+
+def decode_pcm(audio_data):
+    """View raw Polly PCM bytes as an int16 sample array without touching the filesystem."""
+    # Drop a dangling byte so the buffer holds whole 16-bit samples
+    usable = len(audio_data) - len(audio_data) % SAMPLE_DTYPE.itemsize
+    return np.frombuffer(audio_data, dtype=SAMPLE_DTYPE, count=usable // SAMPLE_DTYPE.itemsize)
+
+def fit_to_slot(polly_client, text, voice_id, samples, slot_ms, cache=None, memo=None):
+    """
+    Make synthesized speech fit its cue window instead of being cut mid-word.
+
+    First asks Polly to speak faster with an SSML prosody rate, then time-stretches
+    whatever is still too long while preserving pitch.
+
+    :return:  (samples, method, ratio) where ratio is original length / fitted length
+    """
+    slot = SAMPLE_RATE * slot_ms // 1000
+    original = len(samples)
+    if slot <= 0 or original <= slot:
+        return samples, 'none', 1.0
+
+    method = 'stretch'
+    # Round the rate up a little: Polly's rate scaling is not exactly linear
+    rate = min(MAX_PROSODY_RATE, int(100 * original / slot) + 5)
+    ssml = f'<speak><prosody rate="{rate}%">{escape(text.strip())}</prosody></speak>'
+    audio_data = synthesize_cached(polly_client, ssml, voice_id, cache, 'ssml', memo)
+    if audio_data:
+        faster = decode_pcm(audio_data)
+        if len(faster):
+            samples = faster
+            method = 'prosody'
+    if len(samples) > slot:
+        ratio = min(MAX_STRETCH_RATIO, len(samples) / slot)
+        samples = time_stretch(samples, ratio)
+        method = 'prosody+stretch' if method == 'prosody' else 'stretch'
+    return samples, method, original / max(1, len(samples))
+
+def render_cue(polly_client, subtitle, voice_id, cache=None, fit=True, memo=None):
+    """
+    Synthesize one cue and fit it to its window; runs on the worker pool.
+
+    :return:  (samples, method, ratio), or None when Polly returned no audio
+    """
+    _, start, end, text = subtitle
+    audio_data = synthesize_cached(polly_client, text, voice_id, cache, memo=memo)
+    if not audio_data:
+        return None
+    return fit_rendered(polly_client, subtitle, voice_id, decode_pcm(audio_data), cache, fit, memo)
+
+def fit_rendered(polly_client, subtitle, voice_id, samples, cache=None, fit=True, memo=None):
+    _, start, end, text = subtitle
+    if not fit:
+        return samples, 'none', 1.0
+    return fit_to_slot(polly_client, text, voice_id, samples, time_to_ms(end) - time_to_ms(start), cache, memo)
+
+def plan_cues(subtitles, merge_ms=0):
+    """
+    Group consecutive cues into synthesis requests.
+
+    With merge_ms set, runs of adjacent cues shorter than merge_ms (and close
+    together in time) share one request; otherwise every cue is its own group.
+    Works on streamed cues, holding back at most one group.
+
+    :return:  Generator of lists of cues
+    """
+    group = []
+    chars = 0
+    for subtitle in subtitles:
+        start_ms = time_to_ms(subtitle[1])
+        short = merge_ms and time_to_ms(subtitle[2]) - start_ms < merge_ms
+        if group and (
+            not short
+            or len(group) >= MERGE_MAX_CUES
+            or chars + len(subtitle[3]) > MERGE_MAX_CHARS
+            or start_ms - time_to_ms(group[-1][2]) > MERGE_MAX_GAP_MS
+        ):
+            yield group
+            group = []
+            chars = 0
+        if short:
+            group.append(subtitle)
+            chars += len(subtitle[3])
+        else:
+            yield [subtitle]
+    if group:
+        yield group
+
+def render_group(polly_client, group, voice_id, cache=None, fit=True, memo=None):
+    """
+    Synthesize a group of cues; runs on the worker pool.
 
-    logger.debug(f"Parsed {len(subtitles)} subtitles")
+    A merged group is spoken as one SSML request with a <mark> before each cue.
+    The matching speech marks give the offset of every cue in the returned audio,
+    which is split back onto the original cues. Falls back to one request per
+    cue if Polly does not return the marks.
 
-    full_audio = AudioSegment.silent(duration=0)
-    last_end_time = 0
+    :return:  List of render_cue results, one per cue of the group
+    """
+    if len(group) == 1:
+        return [render_cue(polly_client, group[0], voice_id, cache, fit, memo)]
 
-    logger.debug(f"Total subtitles: {len(subtitles)}")
+    ssml = '<speak>' + ' '.join(f'<mark name="{position}"/>{escape(text.strip())}' for position, (_, _, _, text) in enumerate(group)) + '</speak>'
+    # marks first: when they do not match the group, the merged audio would be wasted on top of the per-cue requests
+    marks_data = synthesize_cached(polly_client, ssml, voice_id, cache, 'ssml', memo, speech_marks=True)
+    offsets = {}
+    for line in (marks_data or b'').splitlines():
+        if line.strip():
+            mark = json.loads(line)
+            offsets[mark['value']] = SAMPLE_RATE * mark['time'] // 1000
+    audio_data = synthesize_cached(polly_client, ssml, voice_id, cache, 'ssml', memo) if len(offsets) == len(group) else None
+    if not audio_data:
+        logger.debug(f"No speech marks for merged cues {group[0][0]}-{group[-1][0]}, synthesizing them one by one")
+        return [render_cue(polly_client, subtitle, voice_id, cache, fit, memo) for subtitle in group]
 
-    for _, (_, start, end, text) in tqdm(enumerate(subtitles), total=len(subtitles), desc="Processing subtitles"):
+    samples = decode_pcm(audio_data)
+    bounds = [offsets[str(position)] for position in range(len(group))] + [len(samples)]
+    return [
+        fit_rendered(polly_client, subtitle, voice_id, samples[bounds[position]:bounds[position + 1]], cache, fit, memo)
+        for position, subtitle in enumerate(group)
+    ]
+
+class SubtitleJob:
+    """
+    Timeline assembly and output of one subtitle file within a run.
+
+    Cues are pulled lazily from the parser and grouped into synthesis requests;
+    rendered cues are accepted strictly in cue order, and the output is written
+    as soon as the last one arrives.
+    """
+
+    def __init__(self, subtitle_file, output_file=None, stream=False, merge_ms=0):
+        self.subtitle_file = subtitle_file
+        self.output_file = output_file or os.path.splitext(subtitle_file)[0] + '_synced.mp3'
+        self.stream = stream
+        self.fitted = []
+        # (group, future) of submitted requests, oldest first
+        self.pending = deque()
+        self.exhausted = False
+        self.finished = False
+
+        subtitles = read_subtitles(subtitle_file)
+        if stream:
+            # A streamed track only holds the window not yet flushed and grows as needed
+            total_duration = 0
+        else:
+            # Size the whole track once from the cue timings, silence is implicit; streamed
+            # cues get a separate pass over their timing lines so synthesis still starts
+            # before parsing ends
+            if isinstance(subtitles, list):
+                total_duration = max((time_to_ms(end) for _, _, end, _ in subtitles), default=0)
+            else:
+                total_duration = scan_end_ms(subtitle_file)
+            logger.debug(f"{subtitle_file}: total duration: {total_duration}ms")
+        self.groups = plan_cues(subtitles, merge_ms)
+        self.timeline = Timeline(total_duration, SAMPLE_RATE)
+        self.encoder = StreamEncoder(self.output_file, SAMPLE_RATE) if stream else None
+
+    def next_group(self):
+        if not self.exhausted:
+            group = next(self.groups, None)
+            if group is not None:
+                return group
+            self.exhausted = True
+        return None
+
+    def accept(self, subtitle, rendered):
+        index, start, end, text = subtitle
         start_ms = time_to_ms(start)
         end_ms = time_to_ms(end)
 
         logger.debug(f"Start: {start}, End: {end}")
         logger.debug(f"Text: {text}")
 
-        if start_ms > last_end_time:
-            silence_duration = start_ms - last_end_time
-            full_audio += AudioSegment.silent(duration=silence_duration)
-            logger.debug(f"Added silence: {silence_duration}ms")
-
-        audio_data = synthesize_speech(polly_client, text, voice_id)
-        if audio_data:
-            temp_file = f"temp_{_}.mp3"
-            with open(temp_file, 'wb') as file:
-                file.write(audio_data)
-            
-            segment = AudioSegment.from_mp3(temp_file)
-            segment_duration = min(len(segment), end_ms - start_ms)
-            full_audio += segment[:segment_duration]
-            last_end_time = start_ms + segment_duration
+        if rendered:
+            samples, method, ratio = rendered
+            if method != 'none':
+                self.fitted.append((index, start, end, method, ratio))
+                logger.debug(f"Fitted cue {index} to {end_ms - start_ms}ms with {method}, ratio {ratio:.2f}")
+            segment_duration = self.timeline.place(start_ms, samples, end_ms - start_ms)
             logger.debug(f"Added audio segment: {segment_duration}ms")
-
-            # Clean up temporary file immediately after use
-            os.remove(temp_file)
         else:
             logger.warning(f"Could not synthesize audio for text: {text}")
 
-        logger.debug(f"Current audio length: {len(full_audio)}ms")
+        # Cues arrive in order, so nothing before this cue's start can change any more
+        if self.stream and self.timeline.pending_ms(start_ms) >= STREAM_CHUNK_MS:
+            self.encoder.write(self.timeline.drain(start_ms))
+            logger.debug(f"Flushed audio up to {start_ms}ms")
+
+        logger.debug(f"Current audio length: {len(self.timeline)}ms")
         logger.debug("---")
 
-    output_file = os.path.splitext(subtitle_file)[0] + '_synced.mp3'
-    full_audio.export(output_file, format="mp3")
-    logger.info(f"Synchronized speech saved to {output_file}")
-    logger.debug(f"Final audio length: {len(full_audio)}ms")
+    def finish(self):
+        if self.stream:
+            self.encoder.write(self.timeline.drain())
+            self.encoder.close()
+        elif self.output_file == '-':
+            self.timeline.to_audio_segment().export(sys.stdout.buffer, format="mp3")
+        else:
+            self.timeline.to_audio_segment().export(self.output_file, format="mp3")
+        self.finished = True
+        logger.info(f"Synchronized speech saved to {self.output_file}")
+        if self.fitted:
+            logger.info(f"Fitted {len(self.fitted)} overlong cues, max ratio {max(ratio for *_, ratio in self.fitted):.2f}")
+        logger.debug(f"Final audio length: {len(self.timeline)}ms")
+
+    def abort(self):
+        if self.encoder and not self.finished:
+            self.encoder.process.kill()
+            self.encoder.process.wait()
+
+def run_jobs(polly_client, jobs, voice_id, workers=DEFAULT_WORKERS, cache=None, fit=True, max_active=1, keep_going=False):
+    """
+    Synthesize the cues of several subtitle files through one worker pool.
+
+    Up to max_active files are open at a time and requests are submitted
+    round-robin across them, so a long file cannot starve the others. At most
+    2 * workers requests are in flight or waiting to be assembled across all
+    files. Each file's output is written as soon as its last cue is assembled,
+    and the next file is opened in its place. Identical cue text is synthesized
+    once per run, whichever file it appears in.
+
+    :param jobs:        Iterable of SubtitleJob, opened lazily in order
+    :param keep_going:  Log and drop a file that fails instead of aborting the whole run
+    :return:            List of (job, exception) of the dropped files
+    """
+    window = max(1, workers) * 2
+    queued = iter(jobs)
+    active = deque()
+    in_flight = 0
+    failed = []
+    memo = SpeechMemo()
+    progress = tqdm(desc="Processing subtitles", unit="cue")
+
+    def drop(job, error):
+        nonlocal in_flight
+        logger.error(f"{job.subtitle_file} failed, skipping it: {error!r}")
+        for _, future in job.pending:
+            future.cancel()
+        in_flight -= len(job.pending)
+        job.pending.clear()
+        job.abort()
+        active.remove(job)
+        failed.append((job, error))
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            while True:
+                while len(active) < max_active:
+                    job = next(queued, None)
+                    if job is None:
+                        break
+                    active.append(job)
+                if not active:
+                    break
+
+                # Fill the window one request per file at a time
+                submitted = True
+                while in_flight < window and submitted:
+                    submitted = False
+                    for job in list(active):
+                        if in_flight >= window:
+                            break
+                        try:
+                            group = job.next_group()
+                        except Exception as error:
+                            if not keep_going:
+                                raise
+                            drop(job, error)
+                            continue
+                        if group is not None:
+                            job.pending.append((group, executor.submit(render_group, polly_client, group, voice_id, cache, fit, memo)))
+                            in_flight += 1
+                            submitted = True
+
+                futures = [job.pending[0][1] for job in active if job.pending]
+                if futures:
+                    wait(futures, return_when=FIRST_COMPLETED)
+
+                for job in list(active):
+                    try:
+                        while job.pending and job.pending[0][1].done():
+                            group, future = job.pending.popleft()
+                            in_flight -= 1
+                            for subtitle, rendered in zip(group, future.result()):
+                                job.accept(subtitle, rendered)
+                            progress.update(len(group))
+                        if job.exhausted and not job.pending:
+                            job.finish()
+                            active.remove(job)
+                    except Exception as error:
+                        if not keep_going:
+                            raise
+                        drop(job, error)
+    except BaseException:
+        for job in active:
+            job.abort()
+        raise
+    finally:
+        progress.close()
+    if memo.hits:
+        logger.info(f"Reused audio for {memo.hits} repeated cues")
+    return failed
+
+def expand_inputs(path):
+    """Resolve a subtitle file, a directory of subtitle files or a glob pattern to a sorted list of files."""
+    if os.path.isdir(path):
+        candidates = [os.path.join(path, name) for name in os.listdir(path)]
+    elif glob.has_magic(path):
+        candidates = glob.glob(path, recursive=True)
+    else:
+        return [path]
+    return sorted(candidate for candidate in candidates
+                  if os.path.isfile(candidate) and os.path.splitext(candidate)[1].lower() in SUBTITLE_EXTENSIONS)
+
+def write_fit_report(fit_report, jobs):
+    with open(fit_report, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['file', 'index', 'start', 'end', 'method', 'ratio'])
+        for job in jobs:
+            writer.writerows((job.subtitle_file, index, start, end, method, f"{ratio:.3f}") for index, start, end, method, ratio in job.fitted)
+
+def convert_text_to_speech(subtitle_file, voice_id, debug=False, workers=DEFAULT_WORKERS, cache_dir=DEFAULT_CACHE_DIR, cache_max_bytes=DEFAULT_MAX_BYTES, output_file=None, stream=False, fit=True, fit_report=None, merge_ms=0, polly_client=None):
+    """
+    Synthesize a subtitle file into one mp3 aligned to the cue timestamps.
+
+    :param cache_dir:        Directory of the segment cache, None to disable it
+    :param cache_max_bytes:  Size cap of the segment cache
+    :param output_file:      Output path, '-' for stdout; defaults to <input>_synced.mp3
+    :param stream:           Encode and flush audio as soon as all cues before it are
+                             resolved instead of exporting the whole track at the end
+    :param fit:              Speed up speech that overruns its cue instead of truncating it
+    :param fit_report:       Optional CSV path receiving the per-cue stretch ratios
+    :param merge_ms:         Merge runs of adjacent cues shorter than this into one request
+    :param polly_client:     Synthesizer backend, e.g. a FakePollyClient; defaults to boto3 Polly
+    """
+    setup_logging(debug)
+    polly_client = polly_client or create_polly_client(workers)
+    cache = SegmentCache(cache_dir, cache_max_bytes) if cache_dir else None
+
+    job = SubtitleJob(subtitle_file, output_file, stream, merge_ms)
+    run_jobs(polly_client, [job], voice_id, workers, cache, fit)
+
+    if fit_report:
+        write_fit_report(fit_report, [job])
+    if cache:
+        logger.info(f"Segment cache: {cache.hits} hits, {cache.misses} misses")
+
+def convert_batch(inputs, voice_id, debug=False, workers=DEFAULT_WORKERS, cache_dir=DEFAULT_CACHE_DIR, cache_max_bytes=DEFAULT_MAX_BYTES, output_dir=None, stream=False, fit=True, fit_report=None, merge_ms=0, max_active=DEFAULT_ACTIVE_FILES, polly_client=None):
+    """
+    Synthesize many subtitle files in one process with one Polly client.
+
+    Cues of all files share a single work queue; each <name>_synced.mp3 is
+    written as soon as its file completes.
+
+    :param inputs:      Subtitle files
+    :param output_dir:  Directory for the mp3 files, laid out like the inputs; defaults to next to each input
+    :param merge_ms:    Merge runs of adjacent cues shorter than this into one request
+    :param max_active:  Number of files assembled concurrently
+    :param polly_client:  Synthesizer backend, e.g. a FakePollyClient; defaults to boto3 Polly
+    :return:            Subtitle files that failed, the others are converted regardless
+    """
+    setup_logging(debug)
+    polly_client = polly_client or create_polly_client(workers)
+    cache = SegmentCache(cache_dir, cache_max_bytes) if cache_dir else None
+
+    # outputs mirror the inputs' layout below their common directory, so s1/ep1.srt and s2/ep1.srt do not collide
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(subtitle_file)) for subtitle_file in inputs]) if inputs else None
+
+    def output_for(subtitle_file):
+        if output_dir is None:
+            return None
+        relative = os.path.relpath(os.path.splitext(os.path.abspath(subtitle_file))[0], root)
+        output_file = os.path.join(output_dir, relative + '_synced.mp3')
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        return output_file
+
+    jobs = []
+    failed = []
+    def open_jobs():
+        # Open files lazily so only the active ones hold parsers and timelines
+        for subtitle_file in inputs:
+            try:
+                job = SubtitleJob(subtitle_file, output_for(subtitle_file), stream, merge_ms)
+            except Exception as error:
+                # one unreadable file must not stop a batch of hundreds
+                logger.error(f"{subtitle_file} failed, skipping it: {error!r}")
+                failed.append(subtitle_file)
+                continue
+            jobs.append(job)
+            yield job
+
+    failed += [job.subtitle_file for job, _ in run_jobs(polly_client, open_jobs(), voice_id, workers, cache, fit, max_active, keep_going=True)]
+    logger.info(f"Converted {len(inputs) - len(failed)} subtitle files")
+    if failed:
+        logger.error(f"{len(failed)} subtitle files failed: {', '.join(failed)}")
+
+    if fit_report:
+        write_fit_report(fit_report, jobs)
+    if cache:
+        logger.info(f"Segment cache: {cache.hits} hits, {cache.misses} misses")
+    return failed
 
 def print_usage_instructions():
     print("Usage Instructions:")
@@ -113,9 +699,9 @@ def print_usage_instructions():
     print("   pip install -r requirements.txt")
     print("2. Set up your AWS credentials (AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY)")
     print("3. Run the script with the following command:")
-    print("   python tts.py <path_to_subtitle_file> <voice_id> [--debug]")
+    print("   python tts.py <path_to_subtitle_file> <voice_id> [--workers N] [--cache-dir DIR | --no-cache] [--debug]")
     print("   Example: python tts.py subtitles.srt Joanna")
-    print("   Supported subtitle formats: .srt, .txt")
+    print("   Supported subtitle formats: .srt, .vtt, .txt")
     # official documentation: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/polly/client/synthesize_speech.html
     print("4. Available voice IDs can be found in the Amazon Polly documentation.")
     # since we are using the generative-latest engine, we are limited to Matthew and Ruth voices
@@ -123,21 +709,58 @@ def print_usage_instructions():
     print("   - Ruth (US English, Female)")
     print("5. The output will be saved as '<input_file_name>_synced.mp3' in the same directory.")
     print("6. Use the --debug flag to enable detailed logging.")
+    print(f"7. Use --workers to set how many Polly requests run concurrently (default {DEFAULT_WORKERS}).")
+    print(f"8. Synthesized cues are cached in {DEFAULT_CACHE_DIR} so re-runs only pay for edited cues.")
+    print("   Use --cache-dir to move the cache, --cache-size-mb to cap it, or --no-cache to bypass it.")
+    print("9. Use --stream to encode audio while synthesis is still running, and --output - to write it to stdout.")
+    print("10. Speech longer than its cue is sped up to fit (SSML prosody rate, then time-stretch).")
+    print("    Use --fit-report FILE to save per-cue ratios, or --no-fit to truncate instead.")
+    print("11. Pass a directory or a quoted glob instead of a file to convert many files in one run:")
+    print("    python tts.py 'episodes/*.srt' Ruth --output out/")
+    print("    All files share one Polly client and work queue; --output then names a directory.")
+    print("12. Repeated cue text is synthesized once per run. Use --merge-short-cues MS to speak runs of")
+    print("    adjacent cues shorter than MS milliseconds in one request, split back with SSML speech marks.")
+    print("13. Use --backend fake to run without AWS using a local tone generator in place of Polly.")
 
 if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser(description="Convert subtitle file to synchronized speech using Amazon Polly")
-    parser.add_argument("subtitle_file", nargs='?', help="Path to the subtitle file (.srt or .txt)")
+    parser.add_argument("subtitle_file", nargs='?', help="Path to the subtitle file (.srt, .vtt or .txt), a directory or a glob pattern")
     parser.add_argument("voice_id", nargs='?', help="Amazon Polly voice ID to use")
     parser.add_argument("--help-usage", action="store_true", help="Show usage instructions")
     parser.add_argument("--debug", action="store_true", help="Enable debug logging")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Number of concurrent Polly requests")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Directory for cached speech segments")
+    parser.add_argument("--cache-size-mb", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), help="Maximum size of the segment cache in MB")
+    parser.add_argument("--no-cache", action="store_true", help="Always call Polly, ignoring the segment cache")
+    parser.add_argument("--output", help="Output mp3 path, '-' for stdout, or output directory in batch mode (default: <input>_synced.mp3)")
+    parser.add_argument("--stream", action="store_true", help="Encode and flush finished audio while later cues are still being synthesized")
+    parser.add_argument("--no-fit", action="store_true", help="Truncate speech that overruns its cue instead of speeding it up")
+    parser.add_argument("--fit-report", help="Write per-cue stretch ratios of fitted cues to this CSV file")
+    parser.add_argument("--backend", choices=["polly", "fake"], default="polly", help="Speech synthesizer to use; 'fake' generates tones locally")
+    parser.add_argument("--merge-short-cues", type=int, default=0, metavar="MS", help="Synthesize runs of adjacent cues shorter than MS milliseconds in one request")
     args = parser.parse_args()
 
     if args.help_usage:
         print_usage_instructions()
     elif args.subtitle_file and args.voice_id:
-        convert_text_to_speech(args.subtitle_file, args.voice_id, args.debug)
+        cache_dir = None if args.no_cache else args.cache_dir
+        cache_max_bytes = args.cache_size_mb * 1024 * 1024
+        polly_client = None
+        if args.backend == "fake":
+            from fake_polly import FakePollyClient
+            polly_client = FakePollyClient()
+            # Never mix generated tones into the cache of real Polly audio
+            cache_dir = None
+        if os.path.isdir(args.subtitle_file) or glob.has_magic(args.subtitle_file):
+            inputs = expand_inputs(args.subtitle_file)
+            if not inputs:
+                parser.error(f"No subtitle files found in {args.subtitle_file}")
+            if convert_batch(inputs, args.voice_id, args.debug, args.workers, cache_dir, cache_max_bytes, args.output, args.stream, not args.no_fit, args.fit_report, args.merge_short_cues, polly_client=polly_client):
+                sys.exit(1)
+        else:
+            convert_text_to_speech(args.subtitle_file, args.voice_id, args.debug, args.workers, cache_dir, cache_max_bytes, args.output, args.stream, not args.no_fit, args.fit_report, args.merge_short_cues, polly_client=polly_client)
     else:
         print("Error: Missing required arguments. Use --help-usage for instructions.")
         parser.print_help()
\ No newline at end of file